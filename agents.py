@@ -1,49 +1,215 @@
-import asana
-from asana.rest import ApiException
-from openai import OpenAI
 from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
 from datetime import datetime
 import json
 import os
-from twilio.rest import Client
 
-# Load environment variables from .env file
+# Load environment variables from .env file. The modules below read their settings
+# when they are imported, so this runs first
 load_dotenv()
 
-# Initialize the OpenAI client
-client = OpenAI()
+import clients
+from task_cache import task_cache
+from completion_cache import completion_cache
+from task_mirror import TaskMirror
+from search_index import TaskSearchIndex
+from history import fit_history
+from tool_registry import registry, tool
+from outbox import WhatsAppOutbox, PermanentDeliveryError
+from notify_coalescer import NotificationCoalescer
+from asana_webhooks import WebhookReceiver
+from intent_router import IntentRouter
+from tool_output import DEFAULT_MAX_ITEMS, project, render_tool_output
+from metrics import record_token_usage, span, track
+from asana_limiter import is_connection_error
+
+# The OpenAI, Asana and Twilio clients are shared providers in clients.py, built on first use
 # Set the OpenAI model to use (default is gpt-4o if not specified in .env)
 model = os.getenv('OPENAI_MODEL', 'gpt-4o')
 
+# WhatsApp sender number for Twilio
+whatsapp_from = os.getenv("TWILIO_WHATSAPP_FROM", "")  # Should be in format "whatsapp:+1234567890"
 
-# Set up Asana API configuration with access token from environment variables
-configuration = asana.Configuration()
-configuration.access_token = os.getenv('ASANA_ACCESS_TOKEN', '')
-api_client = asana.ApiClient(configuration)
+def deliver_whatsapp_message(to, body):
+    """
+    Send one WhatsApp message through Twilio, used by the outbox workers
 
+    Returns:
+        str: The Twilio message SID
 
-# Create instances of the Asana APIs
-tasks_api = asana.TasksApi(api_client)
-stories_api = asana.StoriesApi(api_client)
-projects_api = asana.ProjectsApi(api_client)
+    Raises:
+        PermanentDeliveryError: If Twilio rejected the message and retrying cannot help
+    """
+    from twilio.base.exceptions import TwilioRestException
 
-# Initialize Twilio client for WhatsApp
-twilio_account_sid = os.getenv("TWILIO_ACCOUNT_SID", "")
-twilio_auth_token = os.getenv("TWILIO_AUTH_TOKEN", "")
-twilio_client = Client(twilio_account_sid, twilio_auth_token)
-whatsapp_from = os.getenv("TWILIO_WHATSAPP_FROM", "")  # Should be in format "whatsapp:+1234567890"
+    try:
+        with track("twilio", "messages.create"):
+            return clients.twilio_client().messages.create(body=body, from_=whatsapp_from, to=to).sid
+    except TwilioRestException as e:
+        # 4xx errors other than rate limiting mean the message itself is invalid
+        if 400 <= e.status < 500 and e.status != 429:
+            raise PermanentDeliveryError(str(e)) from e
+        raise
+
+# Outgoing WhatsApp messages are queued in a persistent outbox and sent by a
+# rate-limited worker pool, so callers never wait on Twilio
+whatsapp_outbox = WhatsAppOutbox(
+    os.getenv("WHATSAPP_OUTBOX_PATH", "whatsapp_outbox.db"),
+    deliver_whatsapp_message,
+    workers=int(os.getenv("WHATSAPP_OUTBOX_WORKERS", "4")),
+    rate=float(os.getenv("WHATSAPP_MESSAGES_PER_SECOND", "1")),
+    burst=int(os.getenv("WHATSAPP_BURST", "5")),
+    max_attempts=int(os.getenv("WHATSAPP_MAX_ATTEMPTS", "5")),
+)
+
+# Task notifications to the same recipient are merged into one digest message
+# per NOTIFY_COALESCE_SECONDS window (0 sends each notification on its own)
+task_notifications = NotificationCoalescer(
+    whatsapp_outbox.enqueue,
+    window=float(os.getenv("NOTIFY_COALESCE_SECONDS", "5")),
+    max_batch=int(os.getenv("NOTIFY_MAX_BATCH", "10")),
+)
+
+# Fields requested up front when listing tasks, so a listing is a single Asana call
+TASK_LIST_FIELDS = "name,due_on,completed,notes,assignee.name,modified_at"
+# Fields of a task shown to the AI in tool outputs
+TASK_OUTPUT_FIELDS = "name,due_on,completed,notes,assignee.name"
+# Fields of a task search result shown to the AI
+SEARCH_OUTPUT_FIELDS = "name,due_on,completed,assignee.name"
+# Fields requested for a comment created by the AI
+STORY_FIELDS = "text,created_at"
+# Asana returns at most 100 tasks per page
+TASK_PAGE_SIZE = 100
+# Prefix of listing cursors that point into the local mirror rather than at an Asana offset
+MIRROR_CURSOR_PREFIX = "mirror:"
+# Asana's batch endpoint accepts at most 10 actions per request
+BATCH_ACTION_LIMIT = 10
+# Maximum number of batch requests in flight at once when fetching full task details
+ASANA_MAX_CONCURRENCY = int(os.getenv("ASANA_MAX_CONCURRENCY", "4"))
+# Maximum number of tool calls from a single model turn that run at the same time
+TOOL_CALL_CONCURRENCY = int(os.getenv("TOOL_CALL_CONCURRENCY", "8"))
+# Maximum number of tool rounds the agent runs for one user message before it must answer
+AGENT_MAX_STEPS = int(os.getenv("AGENT_MAX_STEPS", "5"))
+
+# Local full-text index of the project's tasks, kept up to date by the mirror below
+search_index = TaskSearchIndex()
+
+def apply_mirror_changes(tasks, removed=(), reset=False):
+    """Bring the search index and cached answers up to date with a change to the mirror"""
+    search_index.apply_changes(tasks, removed, reset)
+    # Cached answers may describe the old state of the changed tasks
+    if tasks or removed:
+        completion_cache.clear()
+
+# Optional local SQLite mirror of the project, enabled by setting ASANA_MIRROR_PATH.
+# Once its initial load is done, task listings and searches are served locally
+task_mirror = None
+if os.getenv("ASANA_MIRROR_PATH"):
+    task_mirror = TaskMirror(
+        os.getenv("ASANA_MIRROR_PATH"),
+        os.getenv("ASANA_PROJECT_ID", ""),
+        clients.tasks_api,
+        clients.events_api,
+        fields=TASK_LIST_FIELDS,
+        refresh_interval=float(os.getenv("ASANA_MIRROR_REFRESH_SECONDS", "30")),
+        on_change=apply_mirror_changes,
+        poll_interval=float(os.getenv("ASANA_MIRROR_POLL_SECONDS", "1")),
+    )
+
+def record_task_write(task_id=None, task=None):
+    """
+    Bring local task state up to date after a write made through this service
+
+    Args:
+        task_id (str, optional): GID of the task that was written
+        task (dict, optional): The task record returned by the write, if any
+    """
+    # Cached listings and searches may contain the task, or no longer include every task.
+    # Write responses may be limited by opt_fields, so they are not cached as full records
+    task_cache.invalidate_task(task_id)
+    # Cached answers may describe the old state of the task
+    completion_cache.clear()
+    if task and task_mirror is not None:
+        task_mirror.upsert_task(task)
+
+def apply_task_events(events):
+    """
+    Apply the events of Asana webhook deliveries to local task state
 
+    Tasks deleted or removed from the project are dropped from the mirror. Other
+    changed tasks are re-read with one batch call, stored in the task cache and
+    the mirror, and reported to the WhatsApp numbers in ASANA_WEBHOOK_NOTIFY.
+
+    Args:
+        events (list): Webhook events, e.g. {"action": "changed", "resource": {...},
+            "parent": {...}, "change": {"field": "completed"}}
+    """
+    project_id = os.getenv("ASANA_PROJECT_ID", "")
+    changes = {}  # task gid -> events about it, in delivery order
+    removed = set()
+    for event in events:
+        resource = event.get("resource") or {}
+        if resource.get("resource_type") != "task":
+            continue
+        gid = resource["gid"]
+        parent = event.get("parent") or {}
+        if event.get("action") == "deleted" or (
+            event.get("action") == "removed" and parent.get("gid") == project_id
+        ):
+            removed.add(gid)
+            changes.pop(gid, None)
+        else:
+            removed.discard(gid)
+            changes.setdefault(gid, []).append(event)
+    if not changes and not removed:
+        return
+
+    for gid in list(changes) + list(removed):
+        task_cache.invalidate_task(gid)
+    completion_cache.clear()
+    if task_mirror is not None:
+        task_mirror.remove_tasks(removed)
+
+    recipients = [number.strip() for number in os.getenv("ASANA_WEBHOOK_NOTIFY", "").split(",") if number.strip()]
+    for task in fetch_task_details(list(changes)):
+        if "error" in task:
+            continue
+        if task_mirror is not None:
+            task_mirror.upsert_task(task)
+        task_events = changes[task["gid"]]
+        if any(event.get("action") == "added" and (event.get("parent") or {}).get("gid") == project_id
+               for event in task_events):
+            status = "created"
+        elif task.get("completed") and any((event.get("change") or {}).get("field") == "completed"
+                                           for event in task_events):
+            status = "completed"
+        else:
+            status = "updated"
+        for to in recipients:
+            notify_task_update(to, task.get("name", ""), status, task.get("due_on"))
+
+# Receiver of Asana webhook deliveries for /asana/webhook. The secret from the
+# webhook's handshake is kept in ASANA_WEBHOOK_SECRET_PATH. A handshake is only
+# accepted while the file ASANA_WEBHOOK_SECRET_PATH + ".register" exists
+asana_webhook = WebhookReceiver(
+    apply_task_events,
+    os.getenv("ASANA_WEBHOOK_SECRET_PATH", "asana_webhook_secret"),
+    queue_size=int(os.getenv("ASANA_WEBHOOK_QUEUE_SIZE", "100")),
+)
+
+@tool
 def create_asana_task(task_name, due_on="today", notes=""):
     """
-    create a task in Asana give the name of the task and when it is due
+    Create a task in Asana given the name of the task and when it is due
 
     Example call:
 
 
     create_asana_task("Test Task", "2025-05-05")
     Args:
-        task_name(str): The name of the task in Asana
-        due_on (str): The date the task is due format YYYY-MM-DD. If not given, the current dayis used
+        task_name (str): The name of the task in Asana
+        due_on (str): The date the task is due format YYYY-MM-DD. If not given, the current day is used
         notes (str): Additional description for the task
     Returns:
     str: The API response of adding the task to asana or an error mesasage if the API call threw an error    
@@ -64,39 +230,231 @@ def create_asana_task(task_name, due_on="today", notes=""):
 
     try: 
         # Call Asana API to create the task
-        api_response = tasks_api.create_task(task_body, {})
-        return json.dumps(api_response, indent=2)  # Return the response as a formatted JSON string
-    except ApiException as e:
+        # Only ask for the fields the mirror and the AI need
+        api_response = clients.tasks_api().create_task(task_body, {"opt_fields": TASK_LIST_FIELDS})
+        record_task_write(api_response.get("gid"), api_response)
+        return render_tool_output("create_asana_task", api_response, TASK_OUTPUT_FIELDS)
+    except clients.ApiException as e:
         # Return error message if API call fails
         return f"Exception when calling TasksApi->create_task: {e}"
 
-def get_asana_tasks(limit=10):
+def run_batch_actions(actions):
+    """
+    Run Asana API actions through the batch endpoint
+
+    Actions are packed into batch requests of BATCH_ACTION_LIMIT actions, and the
+    batch requests run concurrently (at most ASANA_MAX_CONCURRENCY at a time). When a
+    batch request itself fails, only the actions it carried get a failed result, so
+    the results of the other requests, e.g. tasks already created, are not lost.
+
+    Args:
+        actions (list): Batch actions, e.g. {"method": "get", "relative_path": "/tasks/123"}
+
+    Returns:
+        list: One {"status_code": ..., "body": ...} result per action, in the same order
+    """
+    def run_chunk(chunk):
+        try:
+            response = clients.batch_api().create_batch_request({"data": {"actions": chunk}}, {}, full_payload=True)
+            return response["data"]
+        except Exception as e:
+            if not isinstance(e, clients.ApiException) and not is_connection_error(e):
+                raise
+            # Batch requests are not retried, and Asana may have applied some of the actions
+            detail = f"{e.status} {e.reason}" if isinstance(e, clients.ApiException) else str(e)
+            message = f"Batch request failed ({detail}), so this operation may or may not have been applied"
+            error = {"status_code": getattr(e, "status", None) or 0, "body": {"errors": [{"message": message}]}}
+            return [error] * len(chunk)
+
+    chunks = [actions[i:i + BATCH_ACTION_LIMIT] for i in range(0, len(actions), BATCH_ACTION_LIMIT)]
+    if len(chunks) <= 1:
+        return run_chunk(chunks[0]) if chunks else []
+
+    with ThreadPoolExecutor(max_workers=min(ASANA_MAX_CONCURRENCY, len(chunks))) as executor:
+        return [result for chunk_results in executor.map(run_chunk, chunks) for result in chunk_results]
+
+def fetch_task_details(task_ids):
+    """
+    Fetch the complete task record for each task GID using Asana's batch endpoint
+
+    Args:
+        task_ids (list): The Asana task GIDs to fetch
+
+    Returns:
+        list: Task records in the same order as task_ids. A task whose lookup failed
+        is returned as {"gid": ..., "error": ...}
+    """
+    # Only fetch the tasks that are not already cached
+    cached = {task_id: task_cache.get(task_cache.task_key(task_id)) for task_id in task_ids}
+    missing = [task_id for task_id, task in cached.items() if task is None]
+
+    results = run_batch_actions([
+        {"method": "get", "relative_path": f"/tasks/{task_id}"} for task_id in missing
+    ])
+    for task_id, result in zip(missing, results):
+        if result.get("status_code") == 200:
+            cached[task_id] = result["body"]["data"]
+            task_cache.put_task(cached[task_id])
+        else:
+            cached[task_id] = {"gid": task_id, "error": result.get("body")}
+
+    return [cached[task_id] for task_id in task_ids]
+
+def fetch_task_page(limit=10, cursor=None, detailed=False):
+    """
+    Fetch one page of tasks from the configured Asana project
+
+    The page is read from the project mirror when it is enabled and loaded, and
+    otherwise from Asana with TASK_LIST_FIELDS via opt_fields. Asana's `next_page`
+    offset is passed through as the cursor of the following page. With
+    detailed=True the complete task records are fetched afterwards through the
+    batch endpoint instead of one request per task.
+
+    Args:
+        limit (int): Maximum number of tasks to return
+        cursor (str, optional): Cursor returned with the previous page, None for the first page
+        detailed (bool): Whether to fetch the complete task records
+
+    Returns:
+        tuple: (tasks, next_cursor), where next_cursor is None after the last page
+
+    Raises:
+        ApiException: If an Asana API call fails
+    """
+    if task_mirror is not None and task_mirror.is_loaded() and (
+        cursor is None or cursor.startswith(MIRROR_CURSOR_PREFIX)
+    ):
+        offset = int(cursor[len(MIRROR_CURSOR_PREFIX):]) if cursor else 0
+        # Read one task more than asked for to know whether there is a next page
+        tasks = task_mirror.list_tasks(limit + 1, offset)
+        next_cursor = f"{MIRROR_CURSOR_PREFIX}{offset + limit}" if len(tasks) > limit else None
+        tasks = tasks[:limit]
+    else:
+        # Asana pages hold at most 100 tasks, so larger pages take several requests.
+        # Each request asks for exactly the tasks still missing, which keeps the
+        # returned offset aligned with the end of this page
+        tasks = []
+        next_cursor = cursor
+        while True:
+            opts = {"limit": min(limit - len(tasks), TASK_PAGE_SIZE), "opt_fields": TASK_LIST_FIELDS}
+            if next_cursor:
+                opts["offset"] = next_cursor
+            response = clients.tasks_api().get_tasks_for_project(
+                os.getenv("ASANA_PROJECT_ID", ""), opts, full_payload=True
+            )
+            tasks.extend(response["data"])
+            next_cursor = (response.get("next_page") or {}).get("offset")
+            if next_cursor is None or len(tasks) >= limit:
+                break
+
+    if detailed:
+        tasks = fetch_task_details([task["gid"] for task in tasks])
+    return tasks, next_cursor
+
+def fetch_project_tasks(limit=10, detailed=False, cursor=None):
+    """
+    Fetch one page of tasks from the configured Asana project, through the task cache
+
+    Mirror reads skip the cache, since the mirror already applies Asana's changes.
+    See fetch_task_page for the arguments.
+
+    Returns:
+        tuple: (tasks, next_cursor), where next_cursor is None after the last page
+    """
+    project_id = os.getenv("ASANA_PROJECT_ID", "")
+    if task_mirror is not None and task_mirror.is_loaded() and not detailed and (
+        cursor is None or cursor.startswith(MIRROR_CURSOR_PREFIX)
+    ):
+        return fetch_task_page(limit, cursor)
+
+    return task_cache.get_or_load(
+        task_cache.query_key("tasks", project_id, limit, detailed, cursor),
+        lambda: fetch_task_page(limit, cursor, detailed),
+    )
+
+def iter_task_pages(detailed=False, cursor=None, page_size=TASK_PAGE_SIZE):
+    """
+    Walk the project's tasks page by page
+
+    The next page is only fetched once the caller asks for it, so memory use stays
+    at one page however large the project is.
+
+    Yields:
+        tuple: (tasks, next_cursor) for each page, as returned by fetch_task_page
+    """
+    while True:
+        tasks, cursor = fetch_task_page(page_size, cursor, detailed)
+        yield tasks, cursor
+        if cursor is None:
+            return
+
+def iter_asana_tasks(detailed=False, cursor=None, page_size=TASK_PAGE_SIZE):
+    """
+    Yield every task of the project, starting at cursor, fetching pages as they are needed
+
+    Raises:
+        ApiException: If an Asana API call fails
+    """
+    for tasks, _ in iter_task_pages(detailed, cursor, page_size):
+        yield from tasks
+
+def search_workspace_tasks(query):
+    """
+    Search the configured Asana workspace for tasks matching a keyword
+
+    When the project mirror is enabled and loaded, the search is answered from the
+    local index of the project's tasks, ranked by relevance, without calling Asana.
+
+    Args:
+        query (str): Search terms
+
+    Returns:
+        list: Matching tasks with name, due date, completion and assignee
+
+    Raises:
+        ApiException: If the Asana API call fails
+    """
+    if search_index.ready:
+        return search_index.search(query)
+
+    workspace_id = os.getenv("ASANA_WORKSPACE_ID", "")
+
+    def load():
+        search_params = {
+            "text": query,
+            "resource_type": "task",
+            "opt_fields": SEARCH_OUTPUT_FIELDS
+        }
+        return list(clients.tasks_api().search_tasks_for_workspace(workspace_id, search_params))
+
+    normalized_query = " ".join(query.lower().split())
+    return task_cache.get_or_load(task_cache.query_key("search", workspace_id, normalized_query), load)
+
+@tool(read_only=True)
+def get_asana_tasks(limit=10, detailed=False, cursor=None):
     """
     Get a list of tasks from the Asana project
     
     Args:
         limit (int): Maximum number of tasks to return
+        detailed (bool): Return the complete task records instead of name, due date, completion,
+            notes and assignee. Only set this when those fields are not enough
+        cursor (str, optional): Cursor from a previous call, to get the next page of tasks
     
     Returns:
         str: JSON string containing tasks or error message
     """
-    project_id = os.getenv("ASANA_PROJECT_ID", "")
-    
     try:
-        # Get tasks for the project
-        tasks = projects_api.get_tasks_for_project(project_id, {"limit": limit})
-        
-        # Fetch detailed info for each task
-        detailed_tasks = []
-        for task in tasks:
-            task_id = task['gid']
-            task_info = tasks_api.get_task(task_id, {})
-            detailed_tasks.append(task_info)
-            
-        return json.dumps(detailed_tasks, indent=2)
-    except ApiException as e:
+        tasks, next_cursor = fetch_project_tasks(limit, detailed, cursor)
+        # Detailed records are shown in full, since asking for them is the point
+        output = render_tool_output("get_asana_tasks", tasks, None if detailed else TASK_OUTPUT_FIELDS)
+        if next_cursor:
+            output += f"\nMore tasks available, cursor: {next_cursor}"
+        return output
+    except clients.ApiException as e:
         return f"Exception when calling Asana API: {e}"
 
+@tool
 def update_asana_task(task_id, task_name=None, due_on=None, completed=None, notes=None):
     """
     Update an existing Asana task
@@ -105,7 +463,7 @@ def update_asana_task(task_id, task_name=None, due_on=None, completed=None, note
         task_id (str): The Asana task GID to update
         task_name (str, optional): New name for the task
         due_on (str, optional): New due date in YYYY-MM-DD format
-        completed (bool, optional): Whether the task is completed
+        completed (bool, optional): Mark task as completed (true) or incomplete (false)
         notes (str, optional): Updated notes for the task
     
     Returns:
@@ -129,11 +487,13 @@ def update_asana_task(task_id, task_name=None, due_on=None, completed=None, note
     task_body = {"data": data}
     
     try:
-        api_response = tasks_api.update_task(task_id, task_body, {})
-        return json.dumps(api_response, indent=2)
-    except ApiException as e:
+        api_response = clients.tasks_api().update_task(task_body, task_id, {"opt_fields": TASK_LIST_FIELDS})
+        record_task_write(task_id, api_response)
+        return render_tool_output("update_asana_task", api_response, TASK_OUTPUT_FIELDS)
+    except clients.ApiException as e:
         return f"Exception when updating task: {e}"
 
+@tool
 def add_comment_to_task(task_id, comment_text):
     """
     Add a comment to an Asana task
@@ -151,11 +511,149 @@ def add_comment_to_task(task_id, comment_text):
                 "text": comment_text
             }
         }
-        api_response = stories_api.create_story_for_task(task_id, story_body, {})
-        return json.dumps(api_response, indent=2)
-    except ApiException as e:
+        api_response = clients.stories_api().create_story_for_task(story_body, task_id, {"opt_fields": STORY_FIELDS})
+        # The comment changes the task's stories and modified_at
+        record_task_write(task_id)
+        return render_tool_output("add_comment_to_task", api_response, STORY_FIELDS)
+    except clients.ApiException as e:
         return f"Exception when adding comment: {e}"
 
+def build_task_operation(operation):
+    """
+    Turn a create, update or comment operation into an Asana batch action
+
+    Returns:
+        tuple: (batch action, None), or (None, error message) if the operation is invalid
+    """
+    action = operation.get("action")
+    task_id = operation.get("task_id")
+
+    if action == "create":
+        if not operation.get("task_name"):
+            return None, "task_name is required to create a task"
+        due_on = operation.get("due_on") or "today"
+        # If due_on is "today", set it to the current date
+        if due_on == "today":
+            due_on = str(datetime.now().date())
+        data = {
+            "name": operation["task_name"],
+            "due_on": due_on,
+            "notes": operation.get("notes") or "",
+            "projects": [os.getenv("ASANA_PROJECT_ID", "")]
+        }
+        action = {
+            "method": "post",
+            "relative_path": "/tasks",
+            "data": data,
+            "options": {"fields": TASK_LIST_FIELDS.split(",")}
+        }
+        return action, None
+
+    if action == "update":
+        if not task_id:
+            return None, "task_id is required to update a task"
+        # Map operation fields to Asana fields, keeping only provided ones
+        fields = {"task_name": "name", "due_on": "due_on", "completed": "completed", "notes": "notes"}
+        data = {asana_field: operation[field] for field, asana_field in fields.items() if operation.get(field) is not None}
+        if not data:
+            return None, "No update parameters provided"
+        action = {
+            "method": "put",
+            "relative_path": f"/tasks/{task_id}",
+            "data": data,
+            "options": {"fields": TASK_LIST_FIELDS.split(",")}
+        }
+        return action, None
+
+    if action == "comment":
+        if not task_id or not operation.get("comment_text"):
+            return None, "task_id and comment_text are required to add a comment"
+        data = {"text": operation["comment_text"]}
+        action = {
+            "method": "post",
+            "relative_path": f"/tasks/{task_id}/stories",
+            "data": data,
+            "options": {"fields": STORY_FIELDS.split(",")}
+        }
+        return action, None
+
+    return None, f"Unknown action: {action}"
+
+def apply_task_operations(operations):
+    """
+    Apply a list of create, update and comment operations through Asana's batch endpoint
+
+    Args:
+        operations (list): Dicts with an "action" of "create", "update" or "comment" and
+            the fields of that action (task_name, due_on, notes, task_id, completed, comment_text)
+
+    Returns:
+        list: One result per operation, in the same order, with "action", "ok" and
+        either "data" (the created or updated record) or "error"
+    """
+    results = [None] * len(operations)
+    actions, positions = [], []
+    for position, operation in enumerate(operations):
+        action, error = build_task_operation(operation)
+        if error:
+            results[position] = {"action": operation.get("action"), "ok": False, "error": error}
+        else:
+            actions.append(action)
+            positions.append(position)
+
+    for position, result in zip(positions, run_batch_actions(actions)):
+        operation = operations[position]
+        body = result.get("body") or {}
+        if 200 <= result.get("status_code", 500) < 300:
+            data = body.get("data")
+            results[position] = {"action": operation["action"], "ok": True, "data": data}
+            if operation["action"] == "comment":
+                record_task_write(operation["task_id"])
+            else:
+                record_task_write(data.get("gid"), data)
+        else:
+            results[position] = {"action": operation["action"], "ok": False, "error": body.get("errors", body)}
+    return results
+
+@tool(properties={
+    "operations": {
+        "items": {
+            "type": "object",
+            "properties": {
+                "action": {"type": "string", "enum": ["create", "update", "comment"]},
+                "task_id": {"type": "string", "description": "The Asana task GID, for update and comment"},
+                "task_name": {"type": "string", "description": "Task name, required for create"},
+                "due_on": {"type": "string", "description": "Due date in YYYY-MM-DD format"},
+                "notes": {"type": "string", "description": "Task notes"},
+                "completed": {"type": "boolean", "description": "Mark task as completed (true) or incomplete (false)"},
+                "comment_text": {"type": "string", "description": "Comment text, required for comment"}
+            },
+            "required": ["action"]
+        }
+    }
+})
+def batch_task_operations(operations):
+    """
+    Create, update or comment on many Asana tasks at once. Use this instead of repeated single calls when acting on several tasks
+
+    Args:
+        operations (list): The operations to apply, each with an action of create, update or comment
+
+    Returns:
+        str: JSON list with one result per operation or an error message
+    """
+    try:
+        results = apply_task_operations(operations)
+        # Project each created or updated record to the fields the AI needs
+        for result in results:
+            if result.get("data"):
+                fields = STORY_FIELDS if result["action"] == "comment" else TASK_OUTPUT_FIELDS
+                result["data"] = project(result["data"], fields)
+        return render_tool_output("batch_task_operations", results)
+    except clients.ApiException as e:
+        return f"Exception when running batch operations: {e}"
+
+@tool(read_only=True)
 def search_asana_tasks(query):
     """
     Search for tasks by keyword
@@ -166,18 +664,13 @@ def search_asana_tasks(query):
     Returns:
         str: JSON response or error message
     """
-    workspace_id = os.getenv("ASANA_WORKSPACE_ID", "")
     try:
-        search_params = {
-            "text": query,
-            "resource_type": "task",
-            "opt_fields": "name,due_on,completed,assignee"
-        }
-        api_response = asana.SearchApi(api_client).search_tasks_for_workspace(workspace_id, search_params)
-        return json.dumps(api_response, indent=2)
-    except ApiException as e:
+        api_response = search_workspace_tasks(query)
+        return render_tool_output("search_asana_tasks", api_response, SEARCH_OUTPUT_FIELDS)
+    except clients.ApiException as e:
         return f"Exception when searching tasks: {e}"
 
+@tool
 def send_whatsapp_message(to, message):
     """
     Send a WhatsApp message using Twilio
@@ -187,21 +680,18 @@ def send_whatsapp_message(to, message):
         message (str): The message content to send
     
     Returns:
-        str: Success message or error details
+        str: Confirmation that the message was queued for delivery, or error details
     """
     if not to.startswith("whatsapp:"):
         to = f"whatsapp:{to}"
     
     try:
-        message = twilio_client.messages.create(
-            body=message,
-            from_=whatsapp_from,
-            to=to
-        )
-        return f"Message sent successfully! SID: {message.sid}"
+        message_id = whatsapp_outbox.enqueue(to, message)
+        return f"Message queued for delivery! ID: {message_id}"
     except Exception as e:
         return f"Error sending WhatsApp message: {str(e)}"
 
+@tool(enums={"status": ["created", "updated", "completed"]})
 def notify_task_update(to, task_name, status="created", due_date=None):
     """
     Send a WhatsApp notification about a task update
@@ -213,243 +703,235 @@ def notify_task_update(to, task_name, status="created", due_date=None):
         due_date (str, optional): Due date of the task
     
     Returns:
-        str: Result of the send operation
+        str: Confirmation that the notification was queued, or error details
     """
-    due_text = f" due on {due_date}" if due_date else ""
-    message = f"Task update: '{task_name}' has been {status}{due_text}."
-    
-    return send_whatsapp_message(to, message)
-
-def get_tools():
-    # Define tools (functions) that the AI can use
-    # This follows OpenAI's function calling format
-    tools = [
-        {
-            "type": "function",
-            "function": {
-                "name": "create_asana_task",
-                "description": "Create a task in Asana given the name of the task and when it is due",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "task_name": {
-                            "type": "string",
-                            "description": "The name of the task in Asana"
-                        },
-                        "due_on": {
-                            "type": "string",
-                            "description": "The date the task is due format YYYY-MM-DD. If not given, the current day is used"
-                        },
-                        "notes": {
-                            "type": "string",
-                            "description": "Additional notes or description for the task"
-                        }
-                    },
-                    "required": ["task_name"]
-                }
-            }
-        },
-        {
-            "type": "function",
-            "function": {
-                "name": "get_asana_tasks",
-                "description": "Get a list of tasks from your Asana project",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "limit": {
-                            "type": "integer",
-                            "description": "Maximum number of tasks to retrieve"
-                        }
-                    }
-                }
-            }
-        },
-        {
-            "type": "function",
-            "function": {
-                "name": "update_asana_task",
-                "description": "Update an existing Asana task details",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "task_id": {
-                            "type": "string",
-                            "description": "The Asana task GID to update"
-                        },
-                        "task_name": {
-                            "type": "string",
-                            "description": "New name for the task"
-                        },
-                        "due_on": {
-                            "type": "string",
-                            "description": "New due date in YYYY-MM-DD format"
-                        },
-                        "completed": {
-                            "type": "boolean",
-                            "description": "Mark task as completed (true) or incomplete (false)"
-                        },
-                        "notes": {
-                            "type": "string",
-                            "description": "Updated notes for the task"
-                        }
-                    },
-                    "required": ["task_id"]
-                }
-            }
-        },
-        {
-            "type": "function",
-            "function": {
-                "name": "add_comment_to_task",
-                "description": "Add a comment to an existing Asana task",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "task_id": {
-                            "type": "string",
-                            "description": "The Asana task GID"
-                        },
-                        "comment_text": {
-                            "type": "string",
-                            "description": "The comment text to add to the task"
-                        }
-                    },
-                    "required": ["task_id", "comment_text"]
-                }
-            }
-        },
-        {
-            "type": "function",
-            "function": {
-                "name": "search_asana_tasks",
-                "description": "Search for tasks by keyword",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "query": {
-                            "type": "string",
-                            "description": "Search terms to find relevant tasks"
-                        }
-                    },
-                    "required": ["query"]
-                }
-            }
-        },
-        {
-            "type": "function",
-            "function": {
-                "name": "send_whatsapp_message",
-                "description": "Send a WhatsApp message to a specified phone number",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "to": {
-                            "type": "string",
-                            "description": "Recipient's phone number (e.g., '+1234567890')"
-                        },
-                        "message": {
-                            "type": "string",
-                            "description": "Message content to send"
-                        }
-                    },
-                    "required": ["to", "message"]
-                }
-            }
-        },
-        {
-            "type": "function",
-            "function": {
-                "name": "notify_task_update",
-                "description": "Send a WhatsApp notification about a task update",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "to": {
-                            "type": "string",
-                            "description": "Recipient's phone number (e.g., '+1234567890')"
-                        },
-                        "task_name": {
-                            "type": "string",
-                            "description": "Name of the task"
-                        },
-                        "status": {
-                            "type": "string",
-                            "description": "Status of the task (created/updated/completed)",
-                            "enum": ["created", "updated", "completed"]
-                        },
-                        "due_date": {
-                            "type": "string",
-                            "description": "Due date of the task (optional)"
-                        }
-                    },
-                    "required": ["to", "task_name"]
-                }
-            }
-        }
-    ]
-    return tools
-
-def prompt_ai(messages):
-    # Send the conversation to OpenAI API with our defined tools
-    completion = client.chat.completions.create(
-        model=model,
-        messages=messages,
-        tools=get_tools(),
-    )
-    
-    # Extract the response message and any tool calls
-    response_message = completion.choices[0].message
-    tool_calls = response_message.tool_calls
-
-
-    if tool_calls:
-        # If the AI wants to use tools (like creating an Asana task)
-        
-        # Map function names to actual Python functions
-        available_functions = {
-            "create_asana_task": create_asana_task,
-            "get_asana_tasks": get_asana_tasks,
-            "update_asana_task": update_asana_task,
-            "add_comment_to_task": add_comment_to_task,
-            "search_asana_tasks": search_asana_tasks,
-            "send_whatsapp_message": send_whatsapp_message,
-            "notify_task_update": notify_task_update
-        }
+    if not to.startswith("whatsapp:"):
+        to = f"whatsapp:{to}"
 
+    try:
+        # Notifications sent in quick succession, e.g. during bulk updates, go out as one digest
+        task_notifications.add(to, task_name, status, due_date)
+        return f"Notification for '{task_name}' queued for delivery"
+    except Exception as e:
+        return f"Error sending notification: {str(e)}"
+
+# Answers of the intent router. Override with JSON, e.g. INTENT_TEMPLATES='{"no_tasks": "Nothing to do!"}'
+INTENT_TEMPLATES = {
+    "task": "- {name} (ID {gid}{details})",
+    "task_list": "Here are your tasks:\n{tasks}",
+    "more_tasks": "\nThere are more tasks in the project.",
+    "no_tasks": "There are no tasks in the project.",
+    "search_results": "Tasks matching \"{query}\":\n{tasks}",
+    "no_search_results": "No tasks match \"{query}\".",
+    "task_completed": "Marked \"{name}\" as complete.",
+    "error": "Sorry, that didn't work: {error}",
+    **json.loads(os.getenv("INTENT_TEMPLATES", "{}")),
+}
+# Words that make a search a filter the model should interpret, e.g. "search for tasks due today"
+SEARCH_FILTER_WORDS = {"due", "overdue", "assigned", "completed", "incomplete", "open", "today", "tomorrow", "week"}
+# Searches made up only of these words (and numbers) are listings, lookups or references to
+# earlier messages, e.g. "find my tasks", "find task 123" or "find it"
+SEARCH_LISTING_WORDS = {
+    "my", "all", "the", "a", "an", "of", "task", "tasks",
+    "it", "this", "that", "these", "those", "me", "them", "him", "her", "us", "one", "ones",
+    "everything", "something", "anything", "nothing", "stuff",
+}
+
+# Simple commands answered without the model. INTENT_ROUTES limits the routes to a
+# comma-separated list, e.g. "get_asana_tasks,search_asana_tasks"; set it empty to ask the model every time
+intents = IntentRouter(
+    enabled=None if os.getenv("INTENT_ROUTES") is None
+    else [name.strip() for name in os.getenv("INTENT_ROUTES").split(",") if name.strip()]
+)
+
+def format_task_lines(tasks):
+    lines = []
+    for task in tasks:
+        details = f", due {task['due_on']}" if task.get("due_on") else ""
+        if task.get("completed"):
+            details += ", completed"
+        lines.append(INTENT_TEMPLATES["task"].format(name=task.get("name", ""), gid=task["gid"], details=details))
+    return "\n".join(lines)
+
+def format_api_error(e):
+    return INTENT_TEMPLATES["error"].format(error=f"Asana answered {e.status} {e.reason}")
+
+@intents.route(
+    "get_asana_tasks",
+    r"(?:list|show(?: me)?|get|find|search(?: for)?)(?: all)?(?: (?P<limit>\d{1,3}))?(?: of)?(?: my| the)? tasks"
+    r"|what are my tasks",
+)
+def route_list_tasks(match):
+    limit = min(int(match.group("limit") or 10), TASK_PAGE_SIZE)
+    try:
+        tasks, next_cursor = fetch_project_tasks(limit)
+    except clients.ApiException as e:
+        return format_api_error(e)
+    if not tasks:
+        return INTENT_TEMPLATES["no_tasks"]
+    answer = INTENT_TEMPLATES["task_list"].format(tasks=format_task_lines(tasks))
+    if next_cursor:
+        answer += INTENT_TEMPLATES["more_tasks"]
+    return answer
+
+@intents.route(
+    "search_asana_tasks",
+    r"(?:search|find)(?: for)?(?: tasks? (?:about|for|matching|named))? [\"']?(?P<query>[\w-]+(?: [\w-]+){0,2})[\"']?",
+)
+def route_search_tasks(match):
+    query = match.group("query")
+    words = query.lower().split()
+    if SEARCH_FILTER_WORDS & set(words):
+        return None
+    if all(word in SEARCH_LISTING_WORDS or word.isdigit() for word in words):
+        return None
+    try:
+        tasks = search_workspace_tasks(query)
+    except clients.ApiException as e:
+        return format_api_error(e)
+    if not tasks:
+        return INTENT_TEMPLATES["no_search_results"].format(query=query)
+    return INTENT_TEMPLATES["search_results"].format(query=query, tasks=format_task_lines(tasks[:DEFAULT_MAX_ITEMS]))
+
+@intents.route("update_asana_task", r"(?:complete|finish|close)(?: task)? #?(?P<task_id>\d+)")
+@intents.route("update_asana_task", r"mark(?: task)? #?(?P<task_id>\d+) (?:as )?(?:complete|completed|done)")
+def route_complete_task(match):
+    task_id = match.group("task_id")
+    try:
+        task = clients.tasks_api().update_task({"data": {"completed": True}}, task_id, {"opt_fields": TASK_LIST_FIELDS})
+    except clients.ApiException as e:
+        # The number may not be a task GID, e.g. an option the model listed, so let the model interpret it
+        if e.status is not None and 400 <= e.status < 500 and e.status != 429:
+            return None
+        return format_api_error(e)
+    record_task_write(task_id, task)
+    return INTENT_TEMPLATES["task_completed"].format(name=task.get("name", task_id))
+
+def create_completion(**kwargs):
+    """Request a chat completion from OpenAI, recording its latency and token usage"""
+    with track("openai", "chat.completions.create"):
+        completion = clients.openai_client().chat.completions.create(model=model, **kwargs)
+    record_token_usage(completion)
+    return completion
+
+def run_tool_call(tool_call):
+    """Execute one tool call from the model and build the tool message for its result"""
+    function_name = tool_call.function.name
+    with span("agent.tool_call", tool=function_name):
+        try:
+            # Execute the function with the arguments provided by the AI
+            function_response = registry.call(function_name, tool_call.function.arguments)
+        except Exception as e:
+            # Unknown tools and malformed arguments go back to the model, which can correct itself
+            function_response = f"Error calling {function_name}: {e}"
+
+    return {
+        "tool_call_id": tool_call.id,
+        "role": "tool",
+        "name": function_name,
+        "content": function_response
+    }
+
+def run_tool_calls(tool_calls):
+    """
+    Execute the tool calls of one model response concurrently
 
-        # Add AI's response to the conversation history
-        messages.append(response_message)
+    Returns:
+        list: The tool messages, in the order the AI requested the calls
+    """
+    # The tool calls of one response are independent, so run them concurrently.
+    # executor.map yields results in tool_calls order. Each call runs in a copy of
+    # this thread's context so its span is a child of the turn's span
+    context = contextvars.copy_context()
+    with ThreadPoolExecutor(max_workers=min(TOOL_CALL_CONCURRENCY, len(tool_calls))) as executor:
+        return list(executor.map(lambda tool_call: context.copy().run(run_tool_call, tool_call), tool_calls))
+
+def agent_loop(messages, max_steps=AGENT_MAX_STEPS):
+    """
+    The agent's reasoning loop for one user turn, shared by the CLI and the API
 
+    The model is called with the tools; while it answers with tool calls, the
+    calls are executed and their results sent back, for at most max_steps
+    rounds. The loop ends as soon as the model answers with plain content. If
+    it still wants tools after max_steps rounds, one last completion without
+    tools asks it to answer with what it has.
 
-        # Process each tool call requested by the AI
-        for tool_call in tool_calls:
-            function_name = tool_call.function.name
-            function_to_call = available_functions[function_name]
-            function_args = json.loads(tool_call.function.arguments)
-            # Execute the function with the arguments provided by the AI
-            function_response = function_to_call(**function_args)
+    The loop does no I/O itself, so the CLI can drive it with blocking calls and
+    the API with async ones. It is a generator that yields requests and expects
+    their results to be sent back:
+        ("completion", kwargs): send the ChatCompletion for create(model=model, **kwargs)
+        ("tools", tool_calls): send the tool messages from run_tool_calls(tool_calls)
 
-            # Add the tool response to the conversation history
-            messages.append({
-                "tool_call_id": tool_call.id,
-                "role": "tool",
-                "name": function_name,
-                "content": function_response
-            })
+    Use run_agent_loop to drive it with blocking calls.
 
-        # Call the AI again with the tool results to get a final response
-        second_response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-        )
+    Args:
+        messages (list): The conversation, ending with the user's message. The
+            model's tool calls and the tool results are appended to it in place
+        max_steps (int): Maximum number of tool rounds
 
-        return second_response.choices[0].message.content
+    Returns:
+        str: The model's answer, as the generator's return value
+    """
+    # Keep the conversation within the history token budget
+    messages[:] = fit_history(messages, model=model)
+
+    # Identical conversations get the answer of an earlier turn without side effects
+    cache_key = completion_cache.make_key(model, registry.tools_json, messages)
+    cached_response = completion_cache.get(cache_key)
+    if cached_response is not None:
+        return cached_response
+
+    called_tools = []
+    for _ in range(max_steps):
+        completion = yield "completion", {"messages": messages, "tools": registry.tools}
+        response_message = completion.choices[0].message
+        if not response_message.tool_calls:
+            answer = response_message.content
+            break
+        # Add AI's response and the tool results to the conversation history
+        messages.append(response_message)
+        messages.extend((yield "tools", response_message.tool_calls))
+        called_tools.extend(tool_call.function.name for tool_call in response_message.tool_calls)
+    else:
+        # Out of steps: get a final answer from the results so far
+        completion = yield "completion", {"messages": messages}
+        answer = completion.choices[0].message.content
+
+    if all(registry.is_read_only(name) for name in called_tools):
+        completion_cache.set(cache_key, answer)
+    return answer
+
+def run_agent_loop(messages, max_steps=AGENT_MAX_STEPS):
+    """Drive agent_loop with blocking OpenAI and tool calls and return the answer"""
+    loop = agent_loop(messages, max_steps)
+    try:
+        request = next(loop)
+        while True:
+            kind, payload = request
+            if kind == "completion":
+                with span("agent.completion"):
+                    result = create_completion(**payload)
+            else:
+                result = run_tool_calls(payload)
+            request = loop.send(result)
+    except StopIteration as stop:
+        return stop.value
 
-    # If no tools were called, just return the AI's response
-    return response_message.content
+def prompt_ai(messages):
+    with span("agent.turn"):
+        # Simple commands are answered without the model
+        routed = intents.answer(messages)
+        if routed is not None:
+            return routed[1]
+        return run_agent_loop(messages)
 
 def main():
+    # Keep the local project mirror up to date while the chat runs
+    if task_mirror is not None:
+        task_mirror.start()
+    # Deliver messages left in the outbox by an earlier run
+    whatsapp_outbox.start()
+
     # Initialize conversation with a system message defining the AI's role
     messages = [
         {
@@ -487,6 +969,9 @@ For WhatsApp messages, always confirm the phone number and message content befor
         print(ai_response)
         messages.append({"role": "assistant", "content": ai_response})
 
+    # Send notifications still waiting to be combined before exiting
+    task_notifications.flush_all()
+
 
 # Entry point - run the main function when script is executed directly
 if __name__ == "__main__":
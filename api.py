@@ -1,21 +1,120 @@
-import asana
-from asana.rest import ApiException
-from openai import OpenAI
 from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from datetime import datetime
+from functools import partial
+import asyncio
+import contextvars
 import json
+import logging
 import os
-from twilio.rest import Client
-from fastapi import FastAPI, HTTPException, Body
-from pydantic import BaseModel
-from typing import Optional, List
-import uvicorn
-from fastapi.middleware.cors import CORSMiddleware
+import time
+import uuid
 
-# Load environment variables from .env file
+# Load environment variables from .env file. The modules below read their settings
+# when they are imported, so this runs first
 load_dotenv()
 
-app = FastAPI(title="Asana-WhatsApp Assistant API")
+import clients
+from fastapi import FastAPI, HTTPException, Body, Request, Response
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from pydantic import BaseModel, model_validator
+from typing import Optional, List, Literal
+from types import SimpleNamespace
+from fastapi.middleware.cors import CORSMiddleware
+from history import fit_history
+from agents import (
+    fetch_project_tasks, iter_task_pages, search_workspace_tasks, apply_task_operations, record_task_write, task_mirror,
+    whatsapp_outbox, task_notifications, agent_loop, run_tool_calls, asana_webhook,
+    intents
+)
+from notify_coalescer import format_notification
+from chat_sessions import chat_sessions
+from asana_limiter import TRANSIENT_STATUSES, retry_after
+from metrics import MetricsDirectory, metrics, http_request_seconds, record_token_usage, span, track
+
+# Logged through uvicorn's logger, which uvicorn configures in every worker process
+logger = logging.getLogger("uvicorn.error")
+
+# The Asana and Twilio SDKs only offer blocking calls, so handlers run them on this
+# bounded pool instead of on the event loop
+API_IO_WORKERS = int(os.getenv("API_IO_WORKERS", "32"))
+blocking_io_executor = ThreadPoolExecutor(
+    max_workers=API_IO_WORKERS,
+    thread_name_prefix="api-io",
+)
+
+# With several worker processes, each one writes its metrics to METRICS_DIR so
+# any of them can serve the totals at /metrics (serve.py sets it up)
+metrics_directory = MetricsDirectory(metrics, os.getenv("METRICS_DIR")) if os.getenv("METRICS_DIR") else None
+
+def asana_error(e, message):
+    """
+    Build the HTTP error for a failed Asana call
+
+    Asana rate limiting (after the limiter's retries) becomes a 429 with Asana's
+    Retry-After, and Asana outages a 502; other failures stay a 400.
+    """
+    detail = f"{message}: {str(e)}"
+    if e.status == 429:
+        headers = {"Retry-After": str(int(retry_after(e)))} if retry_after(e) is not None else None
+        return HTTPException(status_code=429, detail=detail, headers=headers)
+    if e.status in TRANSIENT_STATUSES:
+        return HTTPException(status_code=502, detail=detail)
+    return HTTPException(status_code=400, detail=detail)
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking SDK call on the I/O pool and wait for it without stalling the event loop"""
+    loop = asyncio.get_running_loop()
+    # Carry the caller's context over, so spans started by the call are children of the current one
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(blocking_io_executor, partial(context.run, func, *args, **kwargs))
+
+@asynccontextmanager
+async def lifespan(app):
+    pools = clients.http_pool_settings()
+    logger.info(
+        "Worker %d: %d I/O threads, HTTP pools of %d connections per host, idle OpenAI connections kept %ss",
+        os.getpid(), API_IO_WORKERS, pools["pool_size"], pools["keepalive_expiry"],
+    )
+    if pools["pool_size"] < API_IO_WORKERS:
+        logger.warning("HTTP_POOL_SIZE is below API_IO_WORKERS, so parallel SDK calls will wait for connections")
+    # Keep the local project mirror up to date while the server runs
+    if task_mirror is not None:
+        task_mirror.start()
+    # Deliver messages left in the outbox by an earlier run
+    whatsapp_outbox.start()
+    # Apply task changes pushed by Asana webhooks
+    asana_webhook.start()
+    if metrics_directory is not None:
+        metrics_directory.start()
+    yield
+    if metrics_directory is not None:
+        metrics_directory.stop()
+    asana_webhook.stop()
+    if task_mirror is not None:
+        task_mirror.stop()
+    # Hand pending notification digests to the outbox before its workers stop
+    task_notifications.flush_all()
+    whatsapp_outbox.stop()
+    # Let in-flight SDK calls finish before the process exits
+    blocking_io_executor.shutdown(wait=True)
+
+app = FastAPI(title="Asana-WhatsApp Assistant API", lifespan=lifespan)
+
+@app.middleware("http")
+async def record_request_latency(request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    # Label by route template, e.g. /whatsapp/messages/{message_id}, to keep ids out of the labels
+    route = request.scope.get("route")
+    http_request_seconds.observe(
+        time.perf_counter() - started,
+        method=request.method,
+        route=route.path if route is not None else "unmatched",
+        status=response.status_code,
+    )
+    return response
 
 # Add CORS middleware to allow frontend to call this API
 app.add_middleware(
@@ -24,29 +123,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Let the frontend read the cursor of the next page of tasks
+    expose_headers=["X-Next-Cursor"],
 )
 
-# Initialize the OpenAI client
-client = OpenAI()
 # Set the OpenAI model to use (default is gpt-4o if not specified in .env)
 model = os.getenv('OPENAI_MODEL', 'gpt-4o')
 
-# Set up Asana API configuration with access token from environment variables
-configuration = asana.Configuration()
-configuration.access_token = os.getenv('ASANA_ACCESS_TOKEN', '')
-api_client = asana.ApiClient(configuration)
-
-# Create instances of the Asana APIs
-tasks_api = asana.TasksApi(api_client)
-stories_api = asana.StoriesApi(api_client)
-projects_api = asana.ProjectsApi(api_client)
-
-# Initialize Twilio client for WhatsApp
-twilio_account_sid = os.getenv("TWILIO_ACCOUNT_SID", "")
-twilio_auth_token = os.getenv("TWILIO_AUTH_TOKEN", "")
-twilio_client = Client(twilio_account_sid, twilio_auth_token)
-whatsapp_from = os.getenv("TWILIO_WHATSAPP_FROM", "")
-
 # Define API request/response models
 class TaskCreate(BaseModel):
     task_name: str
@@ -60,6 +143,18 @@ class TaskUpdate(BaseModel):
     completed: Optional[bool] = None
     notes: Optional[str] = None
 
+class TaskOperation(BaseModel):
+    action: Literal["create", "update", "comment"]
+    task_id: Optional[str] = None
+    task_name: Optional[str] = None
+    due_on: Optional[str] = None
+    notes: Optional[str] = None
+    completed: Optional[bool] = None
+    comment_text: Optional[str] = None
+
+class TaskBatch(BaseModel):
+    operations: List[TaskOperation]
+
 class Comment(BaseModel):
     task_id: str
     comment_text: str
@@ -79,7 +174,17 @@ class ChatMessage(BaseModel):
     content: str
 
 class ChatRequest(BaseModel):
-    messages: List[ChatMessage]
+    # Either the whole conversation in `messages`, or just the new user `message`
+    # of the server-side session `session_id` (a new session if not given)
+    messages: Optional[List[ChatMessage]] = None
+    session_id: Optional[str] = None
+    message: Optional[str] = None
+
+    @model_validator(mode="after")
+    def check_messages(self):
+        if (self.messages is None) == (self.message is None):
+            raise ValueError("Send either messages or message")
+        return self
 
 @app.post("/tasks/create")
 async def create_task(task: TaskCreate):
@@ -101,31 +206,62 @@ async def create_task(task: TaskCreate):
         }
 
         # Call Asana API to create the task
-        api_response = tasks_api.create_task(task_body, {})
+        api_response = await run_blocking(clients.tasks_api().create_task, task_body, {})
+        await run_blocking(record_task_write, api_response.get("gid"), api_response)
         return api_response
-    except ApiException as e:
+    except clients.ApiException as e:
         # Return error message if API call fails
-        raise HTTPException(status_code=400, detail=f"Error creating task: {str(e)}")
+        raise asana_error(e, "Error creating task")
 
 @app.get("/tasks")
-async def get_tasks(limit: int = 10):
-    """Get a list of tasks from the Asana project"""
-    project_id = os.getenv("ASANA_PROJECT_ID", "")
-    
+async def get_tasks(
+    response: Response,
+    limit: int = 10,
+    detailed: bool = False,
+    cursor: Optional[str] = None,
+    stream: bool = False,
+):
+    """
+    Get a page of tasks from the Asana project
+
+    The cursor of the next page, if there is one, is returned in the X-Next-Cursor
+    header; pass it back as `cursor` to continue. With stream=true every task from
+    `cursor` onwards is streamed as NDJSON, one task per line, while the following
+    pages are fetched; `limit` is ignored.
+    """
+    if stream:
+        return await stream_tasks(detailed, cursor)
     try:
-        # Get tasks for the project
-        tasks = projects_api.get_tasks_for_project(project_id, {"limit": limit})
-        
-        # Fetch detailed info for each task
-        detailed_tasks = []
-        for task in tasks:
-            task_id = task['gid']
-            task_info = tasks_api.get_task(task_id, {})
-            detailed_tasks.append(task_info)
-            
-        return detailed_tasks
-    except ApiException as e:
-        raise HTTPException(status_code=400, detail=f"Error fetching tasks: {str(e)}")
+        tasks, next_cursor = await run_blocking(fetch_project_tasks, limit, detailed, cursor)
+    except clients.ApiException as e:
+        raise asana_error(e, "Error fetching tasks")
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return tasks
+
+async def stream_tasks(detailed, cursor):
+    pages = iter_task_pages(detailed, cursor)
+    # Fetch the first page before responding, so a failing request still gets an error status
+    try:
+        first_page = await run_blocking(next, pages)
+    except clients.ApiException as e:
+        raise asana_error(e, "Error fetching tasks")
+
+    async def ndjson_lines():
+        page = first_page
+        while page is not None:
+            tasks, _ = page
+            for task in tasks:
+                yield json.dumps(task) + "\n"
+            try:
+                # Each page is fetched on the I/O pool only after the previous one was sent
+                page = await run_blocking(next, pages, None)
+            except clients.ApiException as e:
+                # The response has already started, so report the error as the last line
+                yield json.dumps({"error": f"Error fetching tasks: {str(e)}"}) + "\n"
+                return
+
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
 
 @app.put("/tasks/update")
 async def update_task(task: TaskUpdate):
@@ -148,10 +284,11 @@ async def update_task(task: TaskUpdate):
     task_body = {"data": data}
     
     try:
-        api_response = tasks_api.update_task(task.task_id, task_body, {})
+        api_response = await run_blocking(clients.tasks_api().update_task, task_body, task.task_id, {})
+        await run_blocking(record_task_write, task.task_id, api_response)
         return api_response
-    except ApiException as e:
-        raise HTTPException(status_code=400, detail=f"Error updating task: {str(e)}")
+    except clients.ApiException as e:
+        raise asana_error(e, "Error updating task")
 
 @app.post("/tasks/comment")
 async def add_comment(comment: Comment):
@@ -162,140 +299,359 @@ async def add_comment(comment: Comment):
                 "text": comment.comment_text
             }
         }
-        api_response = stories_api.create_story_for_task(comment.task_id, story_body, {})
+        api_response = await run_blocking(clients.stories_api().create_story_for_task, story_body, comment.task_id, {})
+        # The comment changes the task's stories and modified_at
+        await run_blocking(record_task_write, comment.task_id)
         return api_response
-    except ApiException as e:
-        raise HTTPException(status_code=400, detail=f"Error adding comment: {str(e)}")
+    except clients.ApiException as e:
+        raise asana_error(e, "Error adding comment")
+
+@app.post("/tasks/batch")
+async def batch_tasks(batch: TaskBatch):
+    """Create, update and comment on many tasks through Asana's batch API"""
+    operations = [operation.model_dump(exclude_none=True) for operation in batch.operations]
+    try:
+        results = await run_blocking(apply_task_operations, operations)
+        return {"results": results}
+    except clients.ApiException as e:
+        raise asana_error(e, "Error running batch operations")
 
 @app.get("/tasks/search")
 async def search_tasks(query: str):
     """Search for tasks by keyword"""
-    workspace_id = os.getenv("ASANA_WORKSPACE_ID", "")
     try:
-        search_params = {
-            "text": query,
-            "resource_type": "task",
-            "opt_fields": "name,due_on,completed,assignee"
-        }
-        api_response = asana.SearchApi(api_client).search_tasks_for_workspace(workspace_id, search_params)
-        return api_response
-    except ApiException as e:
-        raise HTTPException(status_code=400, detail=f"Error searching tasks: {str(e)}")
+        return await run_blocking(search_workspace_tasks, query)
+    except clients.ApiException as e:
+        raise asana_error(e, "Error searching tasks")
+
+@app.post("/asana/webhook")
+async def receive_asana_webhook(request: Request):
+    """
+    Receive Asana webhook deliveries
+
+    The handshake of a new webhook is answered by echoing its X-Hook-Secret, if a
+    registration is expected (see WebhookReceiver). The events of deliveries
+    signed with that secret are queued and applied in the background, so Asana
+    gets its answer right away.
+    """
+    secret = request.headers.get("X-Hook-Secret")
+    if secret is not None:
+        if not asana_webhook.handshake(secret):
+            raise HTTPException(status_code=403, detail="No Asana webhook registration is expected")
+        return Response(status_code=200, headers={"X-Hook-Secret": secret})
+
+    body = await request.body()
+    if not asana_webhook.verify(body, request.headers.get("X-Hook-Signature")):
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
+    try:
+        events = json.loads(body).get("events", [])
+    except (ValueError, AttributeError):
+        raise HTTPException(status_code=400, detail="Invalid webhook payload")
+    if not asana_webhook.submit(events):
+        # Asana retries deliveries that fail
+        raise HTTPException(status_code=503, detail="Too many webhook events queued")
+    return Response(status_code=200)
 
 @app.post("/whatsapp/send")
 async def send_message(message: WhatsAppMessage):
-    """Send a WhatsApp message using Twilio"""
+    """Queue a WhatsApp message for delivery through Twilio"""
     to = message.to
     if not to.startswith("whatsapp:"):
         to = f"whatsapp:{to}"
     
     try:
-        sent_message = twilio_client.messages.create(
-            body=message.message,
-            from_=whatsapp_from,
-            to=to
-        )
-        return {"status": "success", "message_sid": sent_message.sid}
+        message_id = await run_blocking(whatsapp_outbox.enqueue, to, message.message)
+        return {"status": "queued", "message_id": message_id}
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error sending WhatsApp message: {str(e)}")
 
 @app.post("/whatsapp/notify")
 async def notify_task(notification: TaskNotification):
-    """Send a WhatsApp notification about a task update"""
+    """Queue a WhatsApp notification about a task update"""
     to = notification.to
     if not to.startswith("whatsapp:"):
         to = f"whatsapp:{to}"
     
-    due_text = f" due on {notification.due_date}" if notification.due_date else ""
-    message_body = f"Task update: '{notification.task_name}' has been {notification.status}{due_text}."
+    message_body = format_notification(notification.task_name, notification.status, notification.due_date)
     
     try:
-        sent_message = twilio_client.messages.create(
-            body=message_body,
-            from_=whatsapp_from,
-            to=to
-        )
-        return {"status": "success", "message_sid": sent_message.sid}
+        message_id = await run_blocking(whatsapp_outbox.enqueue, to, message_body)
+        return {"status": "queued", "message_id": message_id}
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error sending notification: {str(e)}")
 
-def get_tools():
-    """Define tools that AI can use"""
-    tools = [
-        {
-            "type": "function",
-            "function": {
-                "name": "create_asana_task",
-                "description": "Create a task in Asana given the name of the task and when it is due",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "task_name": {
-                            "type": "string",
-                            "description": "The name of the task in Asana"
-                        },
-                        "due_on": {
-                            "type": "string",
-                            "description": "The date the task is due format YYYY-MM-DD. If not given, the current day is used"
-                        },
-                        "notes": {
-                            "type": "string",
-                            "description": "Additional notes or description for the task"
-                        }
-                    },
-                    "required": ["task_name"]
-                }
-            }
-        },
-        # Other tools definitions
-        # (Skipping for brevity)
-    ]
-    return tools
+@app.get("/whatsapp/messages/{message_id}")
+async def get_message_status(message_id: int):
+    """Get the delivery status of a queued WhatsApp message"""
+    message = await run_blocking(whatsapp_outbox.get, message_id)
+    if message is None:
+        raise HTTPException(status_code=404, detail=f"Message {message_id} not found")
+    return message
 
-@app.post("/chat")
-async def chat_with_ai(request: ChatRequest):
-    """Chat with the AI assistant"""
-    try:
-        # Format messages for OpenAI API
-        formatted_messages = []
-        for msg in request.messages:
-            formatted_messages.append({"role": msg.role, "content": msg.content})
-        
-        # If this is a new conversation, add the system message
-        if not any(msg.role == "system" for msg in request.messages):
-            formatted_messages.insert(0, {
-                "role": "system",
-                "content": f"""You are a personal assistant who helps manage tasks in Asana and send WhatsApp messages. 
+def system_message():
+    return {
+        "role": "system",
+        "content": f"""You are a personal assistant who helps manage tasks in Asana and send WhatsApp messages. 
 The current date is: {datetime.now().date()}
 You can help users with creating tasks, viewing tasks, updating tasks, commenting on tasks, and sending messages."""
-            })
-        
-        # Send request to OpenAI
-        completion = client.chat.completions.create(
-            model=model,
-            messages=formatted_messages,
-            tools=get_tools(),
-        )
-        
-        # Extract response
-        response_message = completion.choices[0].message
-        
-        # Handle tool calls
-        if response_message.tool_calls:
-            # This would need specialized handling on frontend
-            # For simplicity, we'll just return that tools were requested
-            return {
-                "response": response_message.content,
-                "has_tool_calls": True,
-                "message": "Tool calls are handled on the backend. Please use specific API endpoints for task operations."
-            }
-        
-        # Return simple text response
-        return {"response": response_message.content, "has_tool_calls": False}
+    }
+
+def build_chat_messages(request):
+    """
+    Format the messages of a chat request for the OpenAI API, adding the system message
+    for new conversations and fitting the history into the token budget
+    """
+    # Format messages for OpenAI API
+    formatted_messages = []
+    for msg in request.messages:
+        formatted_messages.append({"role": msg.role, "content": msg.content})
     
+    # If this is a new conversation, add the system message
+    if not any(msg.role == "system" for msg in request.messages):
+        formatted_messages.insert(0, system_message())
+    return fit_history(formatted_messages, model=model)
+
+# One lock per chat session with turns in progress, so the turns of a session run
+# one at a time. Each entry is [lock, number of turns holding or waiting for it]
+session_locks = {}
+
+@asynccontextmanager
+async def chat_turn(request):
+    """
+    Provide the conversation for one chat turn
+
+    For a session request, the history is loaded from the session store with the new
+    user message added. Once the turn completes without an error, the history,
+    now with the turn's tool messages and the answer the caller appended, is saved.
+
+    Yields:
+        tuple: (session_id, messages), with session_id None for a full-history request
+    """
+    if request.message is None:
+        yield None, build_chat_messages(request)
+        return
+
+    session_id = request.session_id or str(uuid.uuid4())
+    entry = session_locks.setdefault(session_id, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            messages = await run_blocking(chat_sessions.load, session_id) or [system_message()]
+            messages.append({"role": "user", "content": request.message})
+            yield session_id, messages
+            await run_blocking(chat_sessions.save, session_id, messages)
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del session_locks[session_id]
+
+@app.get("/chat/sessions/{session_id}")
+async def get_chat_session(session_id: str):
+    """Get the user and assistant messages of a chat session, e.g. to show them after a reload"""
+    messages = await run_blocking(chat_sessions.load, session_id)
+    if messages is None:
+        raise HTTPException(status_code=404, detail=f"Session {session_id} not found")
+    return {
+        "session_id": session_id,
+        "messages": [
+            {"role": message["role"], "content": message["content"]}
+            for message in messages
+            if message.get("role") in ("user", "assistant") and message.get("content")
+        ],
+    }
+
+@app.delete("/chat/sessions/{session_id}")
+async def delete_chat_session(session_id: str):
+    """Forget a chat session"""
+    await run_blocking(chat_sessions.delete, session_id)
+    return {"status": "deleted"}
+
+@app.post("/chat")
+async def chat_with_ai(request: ChatRequest):
+    """
+    Chat with the AI assistant
+
+    Tools are executed on the server by the shared agent loop, so a request such as
+    "find task X and mark it complete" is answered in one call. The response lists
+    the tools that were used, and the session id for session requests.
+    """
+    try:
+        async with chat_turn(request) as (session_id, formatted_messages):
+            with span("agent.turn"):
+                # Simple commands are answered without the model
+                routed = await run_blocking(intents.answer, formatted_messages)
+                if routed is not None:
+                    tools_used, answer = [routed[0]], routed[1]
+                else:
+                    tools_used, answer = await run_chat_loop(formatted_messages)
+            formatted_messages.append({"role": "assistant", "content": answer})
+
+        # Tool calls no longer need handling on the frontend
+        response = {"response": answer, "has_tool_calls": False, "tools_used": tools_used}
+        if session_id is not None:
+            response["session_id"] = session_id
+        return response
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error chatting with AI: {str(e)}")
 
+async def run_chat_loop(formatted_messages):
+    """
+    Drive the agent loop for /chat
+
+    Completions are awaited on the event loop, tool calls (blocking SDK calls) run
+    on the I/O pool.
+
+    Returns:
+        tuple: (names of the tools used, the model's answer)
+    """
+    tools_used = []
+    loop = agent_loop(formatted_messages)
+    try:
+        request_kind, payload = next(loop)
+        while True:
+            if request_kind == "completion":
+                with span("agent.completion"), track("openai", "chat.completions.create"):
+                    result = await clients.async_openai_client().chat.completions.create(model=model, **payload)
+                record_token_usage(result)
+            else:
+                tools_used.extend(tool_call.function.name for tool_call in payload)
+                result = await run_blocking(run_tool_calls, payload)
+            request_kind, payload = loop.send(result)
+    except StopIteration as stop:
+        return tools_used, stop.value
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Latency, error and token usage metrics in the Prometheus text format, summed over all workers"""
+    text = metrics.render() if metrics_directory is None else await run_blocking(metrics_directory.render)
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+def sse_event(event, data):
+    """Format one server-sent event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_completion(payload, result):
+    """
+    Stream one completion of the agent loop, yielding a token event per content delta
+
+    Tool calls arrive as fragments keyed by index and are assembled as they stream in.
+    The assembled response is stored in result["completion"], shaped like the
+    ChatCompletion the agent loop expects.
+    """
+    # Imported here so importing the API does not load the OpenAI SDK
+    from openai.types.chat import ChatCompletionMessage
+
+    tool_calls = {}
+    content = []
+    # The stream is timed from the request until its last chunk. Token usage
+    # is not reported for streamed completions
+    with span("agent.completion"), track("openai", "chat.completions.stream"):
+        stream = await clients.async_openai_client().chat.completions.create(model=model, stream=True, **payload)
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+
+            if delta.content:
+                content.append(delta.content)
+                yield sse_event("token", {"content": delta.content})
+
+            for tool_call_delta in delta.tool_calls or []:
+                tool_call = tool_calls.setdefault(
+                    tool_call_delta.index, {"id": None, "type": "function", "function": {"name": "", "arguments": ""}}
+                )
+                if tool_call_delta.id:
+                    tool_call["id"] = tool_call_delta.id
+                if tool_call_delta.function:
+                    tool_call["function"]["name"] += tool_call_delta.function.name or ""
+                    tool_call["function"]["arguments"] += tool_call_delta.function.arguments or ""
+
+    message = ChatCompletionMessage(
+        role="assistant",
+        content="".join(content) or None,
+        tool_calls=[tool_calls[index] for index in sorted(tool_calls)] or None,
+    )
+    result["completion"] = SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+@app.post("/chat/stream")
+async def chat_with_ai_stream(request: ChatRequest):
+    """
+    Chat with the AI assistant, streaming the reply as server-sent events
+
+    Tools are executed on the server by the shared agent loop, as in /chat.
+
+    Events:
+        token: {"content": ...} for each piece of the reply as the model generates it
+        tool_calls: {"tool_calls": [...]} with the name and arguments of the tools
+            about to run, before each tool round
+        done: {"has_tool_calls": false, "tools_used": [...]} once the reply is complete,
+            plus "session_id" for session requests
+        error: {"detail": ...} if the completion or a tool round fails
+    """
+    async def event_stream():
+        try:
+            async with chat_turn(request) as (session_id, formatted_messages):
+                with span("agent.turn"):
+                    async for event in run_stream_turn(session_id, formatted_messages):
+                        yield event
+        except Exception as e:
+            # The response has already started, so report the error in the stream
+            yield sse_event("error", {"detail": f"Error chatting with AI: {str(e)}"})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        # Stop proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+async def run_stream_turn(session_id, formatted_messages):
+    """Drive one agent turn for /chat/stream, yielding its SSE events"""
+    # Simple commands are answered without the model
+    routed = await run_blocking(intents.answer, formatted_messages)
+    if routed is not None:
+        formatted_messages.append({"role": "assistant", "content": routed[1]})
+        yield sse_event("token", {"content": routed[1]})
+        done = {"has_tool_calls": False, "tools_used": [routed[0]]}
+        if session_id is not None:
+            done["session_id"] = session_id
+        yield sse_event("done", done)
+        return
+
+    tools_used = []
+    streamed = False
+    loop = agent_loop(formatted_messages)
+    try:
+        request_kind, payload = next(loop)
+        while True:
+            if request_kind == "completion":
+                result = {}
+                async for event in stream_completion(payload, result):
+                    yield event
+                streamed = True
+                response = result["completion"]
+            else:
+                tools_used.extend(tool_call.function.name for tool_call in payload)
+                yield sse_event("tool_calls", {"tool_calls": [
+                    {"name": tool_call.function.name, "arguments": tool_call.function.arguments}
+                    for tool_call in payload
+                ]})
+                response = await run_blocking(run_tool_calls, payload)
+            request_kind, payload = loop.send(response)
+    except StopIteration as stop:
+        answer = stop.value
+    formatted_messages.append({"role": "assistant", "content": answer})
+
+    if not streamed:
+        # The answer came from the completion cache
+        yield sse_event("token", {"content": answer})
+    done = {"has_tool_calls": False, "tools_used": tools_used}
+    if session_id is not None:
+        done["session_id"] = session_id
+    yield sse_event("done", done)
+
 if __name__ == "__main__":
-    # Run the API server with uvicorn
+    import uvicorn
+
+    # Run the development server, reloading on code changes. Use serve.py in production
     uvicorn.run("api:app", host="0.0.0.0", port=8000, reload=True) 
\ No newline at end of file
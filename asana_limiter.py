@@ -0,0 +1,142 @@
+import logging
+import os
+import random
+import threading
+import time
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+asana_retries = metrics.counter("asana_retries_total", "Asana calls retried", ("reason",))
+
+# Statuses worth retrying for idempotent calls. 429 is retried for every call,
+# since Asana rejects rate-limited requests without processing them
+TRANSIENT_STATUSES = {500, 502, 503, 504}
+
+
+def retry_after(exception):
+    """Return the Retry-After delay in seconds of a failed Asana call, or None"""
+    headers = getattr(exception, "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def is_connection_error(exception):
+    """Whether a call failed before Asana answered, e.g. a timeout or a dropped connection"""
+    # urllib3 is loaded along with the Asana SDK, so importing it here costs nothing
+    from urllib3.exceptions import HTTPError
+
+    # The SDK reports SSL errors as an ApiException with status 0
+    return isinstance(exception, (HTTPError, ConnectionError)) or getattr(exception, "status", None) == 0
+
+
+class AdaptiveLimiter:
+    """
+    Shared concurrency limiter for Asana calls that adapts to the quota (AIMD)
+
+    At most `limit` calls are in flight at once. Each call that succeeds within
+    `latency_target` seconds raises the limit by 1/limit, i.e. by about one per
+    round of calls. A 429 halves the limit and pauses every call until its
+    Retry-After has passed. A call slower than latency_target lowers the limit
+    by 10%. Decreases happen at most once per `latency_target`, so a burst of
+    failures from one round counts once. Throughput then hovers just under the
+    quota instead of swinging between bursts and failures.
+
+    call() also retries: 429s for every call, and 5xx and connection errors for
+    idempotent calls, with exponential backoff and full jitter.
+    """
+
+    def __init__(self, initial_limit=10, min_limit=1, max_limit=50, latency_target=2.0,
+                 max_retries=4, base_backoff=0.5, max_backoff=30.0):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._last_decrease_at = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Wait for a free slot, and for any Retry-After pause to end"""
+        with self._condition:
+            while True:
+                wait = self._paused_until - time.monotonic()
+                if wait <= 0 and self._in_flight < int(self.limit):
+                    self._in_flight += 1
+                    return
+                self._condition.wait(timeout=wait if wait > 0 else None)
+
+    def release(self, latency, throttled=False, pause=None):
+        """
+        Free a slot and adapt the limit to how the call went
+
+        Args:
+            latency (float): Duration of the call in seconds
+            throttled (bool): Whether Asana answered 429
+            pause (float, optional): Seconds to hold every call back, from Retry-After
+        """
+        with self._condition:
+            self._in_flight -= 1
+            now = time.monotonic()
+            if pause:
+                self._paused_until = max(self._paused_until, now + pause)
+            if throttled or latency > self.latency_target:
+                if now - self._last_decrease_at >= self.latency_target:
+                    factor = 0.5 if throttled else 0.9
+                    self.limit = max(self.min_limit, self.limit * factor)
+                    self._last_decrease_at = now
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def backoff(self, attempt):
+        """Full-jitter exponential backoff for the given retry attempt (0-based)"""
+        return random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+
+    def call(self, func, idempotent=False):
+        """
+        Run func() in a slot, retrying rate-limited and, if idempotent, transient failures
+
+        Raises:
+            Exception: The last failure once retries are exhausted or the failure
+                cannot be retried
+        """
+        for attempt in range(self.max_retries + 1):
+            self.acquire()
+            started = time.monotonic()
+            try:
+                result = func()
+            except Exception as e:
+                status = getattr(e, "status", None)
+                throttled = status == 429
+                pause = retry_after(e) if throttled else None
+                self.release(time.monotonic() - started, throttled=throttled, pause=pause)
+                transient = status in TRANSIENT_STATUSES or is_connection_error(e)
+                if attempt == self.max_retries or not (throttled or (idempotent and transient)):
+                    raise
+                reason = "rate_limited" if throttled else "transient"
+                asana_retries.inc(reason=reason)
+                logger.warning("Asana call failed (%s), retrying: %s", status or type(e).__name__, e)
+                if pause is None:
+                    time.sleep(self.backoff(attempt))
+                # With Retry-After, acquire() waits for the pause to end
+                continue
+            self.release(time.monotonic() - started)
+            return result
+
+
+# Shared limiter of every Asana call made by the CLI agent and the HTTP API
+asana_limiter = AdaptiveLimiter(
+    initial_limit=int(os.getenv("ASANA_CONCURRENCY_INITIAL", "10")),
+    min_limit=int(os.getenv("ASANA_CONCURRENCY_MIN", "1")),
+    max_limit=int(os.getenv("ASANA_CONCURRENCY_MAX", "50")),
+    latency_target=float(os.getenv("ASANA_LATENCY_TARGET", "2.0")),
+    max_retries=int(os.getenv("ASANA_MAX_RETRIES", "4")),
+)
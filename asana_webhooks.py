@@ -0,0 +1,159 @@
+import hashlib
+import hmac
+import logging
+import os
+import queue
+import threading
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+webhook_deliveries = metrics.counter(
+    "asana_webhook_deliveries_total", "Asana webhook deliveries received", ("outcome",)
+)
+
+
+def sign(secret, body):
+    """The X-Hook-Signature of a webhook delivery: the hex HMAC-SHA256 of its body"""
+    return hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+class WebhookReceiver:
+    """
+    Receives Asana webhook deliveries and applies their events in the background
+
+    When a webhook is created, Asana sends a handshake with an X-Hook-Secret
+    header. handshake() stores the secret in `secret_path` so every worker
+    process and later runs can check the X-Hook-Signature of each delivery.
+    The handshake is not authenticated, so it is only accepted while a
+    registration is expected: before creating the webhook, the operator
+    creates the empty file `<secret_path>.register`. The first handshake
+    removes it, and later ones are refused until the operator deletes the
+    secret file and creates the registration file again.
+
+    Verified deliveries go on a queue of at most `queue_size` deliveries, so the
+    endpoint answers without waiting for Asana reads. A worker thread takes
+    everything queued at that moment and passes the events to
+    handle_events(events) in one call, so a burst of deliveries about the same
+    tasks is applied once. When the queue is full, submit() refuses the delivery
+    and Asana sends it again later.
+    """
+
+    def __init__(self, handle_events, secret_path, queue_size=100):
+        self.handle_events = handle_events
+        self.secret_path = secret_path
+        self.registration_path = f"{secret_path}.register"
+        self._secret = None
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _load_secret(self):
+        try:
+            with open(self.secret_path) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def handshake(self, secret):
+        """
+        Store the secret of a new webhook
+
+        Returns:
+            bool: Whether the handshake was accepted
+        """
+        with self._lock:
+            if self._load_secret() is not None:
+                webhook_deliveries.inc(outcome="handshake_refused")
+                return False
+            # Removing the registration file fails for every handshake but one
+            try:
+                os.remove(self.registration_path)
+            except FileNotFoundError:
+                webhook_deliveries.inc(outcome="handshake_unexpected")
+                logger.warning(
+                    "Refused an Asana webhook handshake: create %s before registering a webhook",
+                    self.registration_path,
+                )
+                return False
+            # Create the file readable only by this user, failing if another worker just did
+            try:
+                fd = os.open(self.secret_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            except FileExistsError:
+                webhook_deliveries.inc(outcome="handshake_refused")
+                return False
+            with os.fdopen(fd, "w") as f:
+                f.write(secret)
+            self._secret = secret
+        webhook_deliveries.inc(outcome="handshake")
+        logger.info("Registered Asana webhook secret in %s", self.secret_path)
+        return True
+
+    def verify(self, body, signature):
+        """Whether `signature` is the X-Hook-Signature of `body` under the stored secret"""
+        if not signature:
+            webhook_deliveries.inc(outcome="invalid_signature")
+            return False
+        with self._lock:
+            # Another worker process may have stored the secret, or a new webhook replaced it
+            for reload in (False, True):
+                if reload or self._secret is None:
+                    self._secret = self._load_secret()
+                if self._secret is not None and hmac.compare_digest(sign(self._secret, body), signature):
+                    return True
+        webhook_deliveries.inc(outcome="invalid_signature")
+        return False
+
+    def submit(self, events):
+        """
+        Queue the events of a verified delivery
+
+        Returns:
+            bool: False if the queue is full and the delivery should be retried later
+        """
+        try:
+            self._queue.put_nowait(events)
+        except queue.Full:
+            webhook_deliveries.inc(outcome="queue_full")
+            return False
+        webhook_deliveries.inc(outcome="accepted")
+        return True
+
+    def start(self):
+        """Start the worker that applies queued events"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="asana-webhooks", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Apply the events still queued, then stop the worker"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _take_batch(self):
+        events = []
+        while True:
+            try:
+                events.extend(self._queue.get_nowait())
+            except queue.Empty:
+                return events
+
+    def _run(self):
+        while True:
+            try:
+                events = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return
+                continue
+            events = events + self._take_batch()
+            try:
+                self.handle_events(events)
+            except Exception:
+                logger.exception("Applying %d Asana webhook events failed", len(events))
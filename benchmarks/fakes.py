@@ -0,0 +1,270 @@
+"""
+Local stand-ins for the Asana, Twilio and OpenAI HTTP APIs
+
+Each fake answers the requests this service makes with realistic payloads,
+after a configurable latency. A configurable share of requests fails with a
+500, and another share is rate-limited with a 429 and a Retry-After header.
+They run on a background thread:
+
+    asana = FakeAsana(latency=0.05, error_rate=0.01).start()
+    os.environ["ASANA_BASE_URL"] = asana.url
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import itertools
+import json
+import random
+import re
+import threading
+import time
+
+
+class FakeService:
+    """
+    Base class of the fakes: a threaded HTTP server that routes requests to handle()
+
+    Args:
+        latency (float): Mean response delay in seconds
+        jitter (float): Share of the latency the delay varies by, e.g. 0.5 for +-50%
+        error_rate (float): Share of requests answered with a 500
+        throttle_rate (float): Share of requests answered with a 429
+        retry_after (int): Retry-After seconds sent with each 429
+    """
+
+    def __init__(self, latency=0.0, jitter=0.5, error_rate=0.0, throttle_rate=0.0, retry_after=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.requests = 0
+        self._ids = itertools.count(1)
+        self._server = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def next_id(self):
+        return str(next(self._ids))
+
+    def handle(self, method, path, query, body):
+        """
+        Answer one request
+
+        Returns:
+            tuple: (status, payload) where payload is a dict, or a list of SSE data strings
+        """
+        raise NotImplementedError
+
+    def error_payload(self):
+        return {"errors": [{"message": "Injected failure"}]}
+
+    def start(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def respond(self, method):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                if "json" in (self.headers.get("Content-Type") or ""):
+                    body = json.loads(raw or b"{}")
+                else:
+                    body = {key: values[0] for key, values in parse_qs(raw.decode()).items()}
+                url = urlparse(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+                service.requests += 1
+                if service.latency:
+                    time.sleep(service.latency * random.uniform(1 - service.jitter, 1 + service.jitter))
+                headers = {}
+                roll = random.random()
+                if roll < service.error_rate:
+                    status, payload = 500, service.error_payload()
+                elif roll < service.error_rate + service.throttle_rate:
+                    status, payload = 429, service.error_payload()
+                    headers["Retry-After"] = str(service.retry_after)
+                else:
+                    status, payload = service.handle(method, url.path, query, body)
+
+                if isinstance(payload, list):
+                    data = "".join(f"data: {event}\n\n" for event in payload).encode()
+                    content_type = "text/event-stream"
+                else:
+                    data = json.dumps(payload).encode()
+                    content_type = "application/json"
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self.respond("GET")
+
+            def do_POST(self):
+                self.respond("POST")
+
+            def do_PUT(self):
+                self.respond("PUT")
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name=type(self).__name__, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class FakeAsana(FakeService):
+    """
+    Fake Asana API with a project of `task_count` tasks
+
+    Args:
+        task_count (int): Number of tasks in the project, served in pages with offsets
+        notes_size (int): Length of each task's notes, to vary the payload size
+    """
+
+    def __init__(self, task_count=200, notes_size=200, **kwargs):
+        super().__init__(**kwargs)
+        self.tasks = [self._task(str(gid), f"Task {gid}", "x" * notes_size) for gid in range(1, task_count + 1)]
+
+    @staticmethod
+    def _task(gid, name, notes=""):
+        return {
+            "gid": gid,
+            "resource_type": "task",
+            "name": name,
+            "notes": notes,
+            "due_on": "2024-01-31",
+            "completed": False,
+            "assignee": {"gid": "100", "name": "Alex"},
+            "modified_at": "2024-01-01T00:00:00.000Z",
+        }
+
+    def handle(self, method, path, query, body):
+        if method == "GET" and re.fullmatch(r"/projects/\w+/tasks", path):
+            offset = int(query.get("offset", 0))
+            limit = int(query.get("limit", 100))
+            end = offset + limit
+            next_page = {"offset": str(end)} if end < len(self.tasks) else None
+            return 200, {"data": self.tasks[offset:end], "next_page": next_page}
+        if method == "GET" and re.fullmatch(r"/workspaces/\w+/tasks/search", path):
+            text = query.get("text", "").lower()
+            return 200, {"data": [task for task in self.tasks if text in task["name"].lower()][:100]}
+        if method == "GET" and re.fullmatch(r"/tasks/\w+", path):
+            return 200, {"data": self._task(path.rsplit("/", 1)[1], "Task")}
+        if method == "POST" and path == "/tasks":
+            return 201, {"data": self._task(self.next_id(), body["data"].get("name", ""), body["data"].get("notes", ""))}
+        if method == "PUT" and re.fullmatch(r"/tasks/\w+", path):
+            return 200, {"data": {**self._task(path.rsplit("/", 1)[1], "Task"), **body["data"]}}
+        if method == "POST" and re.fullmatch(r"/tasks/\w+/stories", path):
+            return 201, {"data": {"gid": self.next_id(), "text": body["data"].get("text", ""), "created_at": "2024-01-01T00:00:00.000Z"}}
+        if method == "POST" and path == "/batch":
+            return 200, {"data": [
+                {"status_code": 200, "headers": {}, "body": {"data": self._task(action["relative_path"].rsplit("/", 1)[1], "Task")}}
+                for action in body["data"]["actions"]
+            ]}
+        if method == "GET" and path == "/events":
+            return 412, {"errors": [{"message": "Sync token invalid or too old"}], "sync": f"sync-{self.next_id()}"}
+        return 404, {"errors": [{"message": f"No fake for {method} {path}"}]}
+
+
+class FakeTwilio(FakeService):
+    """Fake Twilio API that accepts every message"""
+
+    def handle(self, method, path, query, body):
+        if method == "POST" and path.endswith("/Messages.json"):
+            return 201, {
+                "sid": f"SM{self.next_id():0>32}",
+                "status": "queued",
+                "to": body.get("To"),
+                "from": body.get("From"),
+                "body": body.get("Body"),
+            }
+        return 404, {"message": f"No fake for {method} {path}"}
+
+    def error_payload(self):
+        return {"code": 20500, "message": "Injected failure", "status": 500}
+
+
+class FakeOpenAI(FakeService):
+    """
+    Fake OpenAI chat completions API
+
+    Args:
+        completion_words (int): Number of words in each text reply, to vary the payload size
+        tool_call_rate (float): Share of requests offering tools whose reply is a
+            get_asana_tasks tool call instead of text
+    """
+
+    def __init__(self, completion_words=50, tool_call_rate=0.5, **kwargs):
+        super().__init__(**kwargs)
+        self.completion_words = completion_words
+        self.tool_call_rate = tool_call_rate
+
+    def error_payload(self):
+        return {"error": {"message": "Injected failure", "type": "server_error"}}
+
+    def handle(self, method, path, query, body):
+        if method != "POST" or not path.endswith("/chat/completions"):
+            return 404, {"error": {"message": f"No fake for {method} {path}"}}
+
+        messages = body.get("messages", [])
+        wants_tool = (
+            body.get("tools") and messages and messages[-1].get("role") == "user"
+            and random.random() < self.tool_call_rate
+        )
+        if wants_tool:
+            message = {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [{
+                    "id": f"call_{self.next_id()}",
+                    "type": "function",
+                    "function": {"name": "get_asana_tasks", "arguments": json.dumps({"limit": 10})},
+                }],
+            }
+            finish_reason = "tool_calls"
+        else:
+            message = {"role": "assistant", "content": " ".join(["word"] * self.completion_words)}
+            finish_reason = "stop"
+
+        completion_id = f"chatcmpl-{self.next_id()}"
+        common = {"id": completion_id, "created": int(time.time()), "model": body.get("model", "gpt-4o")}
+        if body.get("stream"):
+            return 200, self._stream(common, message, finish_reason)
+        return 200, {
+            **common,
+            "object": "chat.completion",
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": {"prompt_tokens": 100, "completion_tokens": self.completion_words, "total_tokens": 100 + self.completion_words},
+        }
+
+    @staticmethod
+    def _stream(common, message, finish_reason):
+        def chunk(delta, finish=None):
+            return json.dumps({
+                **common,
+                "object": "chat.completion.chunk",
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+            })
+
+        events = [chunk({"role": "assistant", "content": ""})]
+        if message.get("tool_calls"):
+            events.append(chunk({"tool_calls": [{"index": 0, **message["tool_calls"][0]}]}))
+        else:
+            events.extend(chunk({"content": f"{word} "}) for word in message["content"].split())
+        events.append(chunk({}, finish_reason))
+        events.append("[DONE]")
+        return events
@@ -0,0 +1,243 @@
+"""
+Offline latency and throughput benchmark
+
+Starts local fakes of the Asana, Twilio and OpenAI APIs (see fakes.py), points
+the service's clients at them, serves api.py with uvicorn on a local port, and
+drives each target at several concurrency levels:
+
+    tasks          GET /tasks
+    chat           POST /chat
+    whatsapp_send  POST /whatsapp/send
+    prompt_ai      one CLI agent turn, agents.prompt_ai
+
+Reports p50/p95/p99 latency and throughput per target and concurrency level.
+The task and completion caches are disabled unless --with-caches is given, so
+every request reaches the fakes. Save a run with --json and compare a later run
+against it with --baseline to fail CI when p95 latency regresses.
+
+Usage:
+    python benchmarks/harness.py --concurrency 1,8,32 --requests 200
+"""
+import argparse
+import itertools
+import json
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.fakes import FakeAsana, FakeOpenAI, FakeTwilio  # noqa: E402
+
+TARGETS = ("tasks", "chat", "whatsapp_send", "prompt_ai")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline latency and throughput benchmark")
+    parser.add_argument("--targets", default=",".join(TARGETS), help="Comma-separated targets to run")
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per target and concurrency level")
+    parser.add_argument("--asana-latency", type=float, default=0.05, help="Mean Asana response delay in seconds")
+    parser.add_argument("--openai-latency", type=float, default=0.3, help="Mean OpenAI response delay in seconds")
+    parser.add_argument("--twilio-latency", type=float, default=0.1, help="Mean Twilio response delay in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of fake responses that are a 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0,
+                        help="Share of fake Asana responses that are a 429 with Retry-After")
+    parser.add_argument("--asana-tasks", type=int, default=200, help="Number of tasks in the fake project")
+    parser.add_argument("--notes-size", type=int, default=200, help="Length of each fake task's notes")
+    parser.add_argument("--completion-words", type=int, default=50, help="Words in each fake completion")
+    parser.add_argument("--tool-call-rate", type=float, default=0.5, help="Share of completions that call a tool")
+    parser.add_argument("--with-caches", action="store_true", help="Keep the task and completion caches enabled")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--baseline", help="Compare p95 latency with the results in this file")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed p95 increase over the baseline before failing, e.g. 0.2 for 20%%")
+    return parser.parse_args()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def configure_environment(args, asana, twilio, openai, tmp):
+    # Must run before agents.py and api.py are imported, since they read their settings at import
+    os.environ.update({
+        "ASANA_BASE_URL": asana.url,
+        "ASANA_ACCESS_TOKEN": "benchmark",
+        "ASANA_PROJECT_ID": "1",
+        "ASANA_WORKSPACE_ID": "1",
+        "OPENAI_BASE_URL": f"{openai.url}/v1",
+        "OPENAI_API_KEY": "benchmark",
+        "TWILIO_BASE_URL": twilio.url,
+        "TWILIO_ACCOUNT_SID": "ACbenchmark",
+        "TWILIO_AUTH_TOKEN": "benchmark",
+        "TWILIO_WHATSAPP_FROM": "whatsapp:+10000000000",
+        "WHATSAPP_OUTBOX_PATH": os.path.join(tmp, "outbox.db"),
+        "WHATSAPP_MESSAGES_PER_SECOND": "1000",
+        "WHATSAPP_BURST": "100",
+    })
+    os.environ.pop("ASANA_MIRROR_PATH", None)
+    if not args.with_caches:
+        os.environ["TASK_CACHE_TTL"] = "0"
+        os.environ["COMPLETION_CACHE_TTL"] = "0"
+
+
+def start_api_server(port):
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config("api:app", host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, name="api-server", daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread
+
+
+def run_load(make_call, concurrency, total):
+    """
+    Run `total` calls from `concurrency` threads, each thread using its own make_call()
+
+    Returns:
+        dict: Request and error counts, latency percentiles in milliseconds and throughput
+    """
+    counter = itertools.count()
+    latencies = []
+    errors = []
+
+    def worker():
+        call = make_call()
+        while next(counter) < total:
+            started = time.perf_counter()
+            try:
+                call()
+            except Exception as e:
+                errors.append(e)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "p50_ms": round(cuts[49], 1),
+        "p95_ms": round(cuts[94], 1),
+        "p99_ms": round(cuts[98], 1),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+    }
+
+
+def http_call(base_url, method, path, **kwargs):
+    import httpx
+
+    def make_call():
+        client = httpx.Client(base_url=base_url, timeout=60)
+
+        def call():
+            client.request(method, path, **kwargs).raise_for_status()
+
+        return call
+
+    return make_call
+
+
+def prompt_ai_call():
+    import agents
+
+    def make_call():
+        def call():
+            agents.prompt_ai([
+                {"role": "system", "content": "You are a personal assistant who helps manage tasks in Asana."},
+                {"role": "user", "content": "What tasks are due this week?"},
+            ])
+
+        return call
+
+    return make_call
+
+
+def compare(results, baseline, tolerance):
+    """Print p95 regressions against the baseline and return whether there were none"""
+    previous = {(row["target"], row["concurrency"]): row for row in baseline}
+    passed = True
+    for row in results:
+        before = previous.get((row["target"], row["concurrency"]))
+        if before and row["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            print(f"REGRESSION {row['target']} at concurrency {row['concurrency']}: "
+                  f"p95 {before['p95_ms']} ms -> {row['p95_ms']} ms")
+            passed = False
+    return passed
+
+
+def main():
+    args = parse_args()
+    targets = [target for target in args.targets.split(",") if target]
+    levels = [int(level) for level in args.concurrency.split(",")]
+    unknown = set(targets) - set(TARGETS)
+    if unknown:
+        sys.exit(f"Unknown targets: {', '.join(sorted(unknown))}")
+
+    fake_options = {"error_rate": args.error_rate}
+    asana = FakeAsana(
+        args.asana_tasks, args.notes_size, latency=args.asana_latency, throttle_rate=args.throttle_rate, **fake_options
+    ).start()
+    twilio = FakeTwilio(latency=args.twilio_latency, **fake_options).start()
+    openai = FakeOpenAI(args.completion_words, args.tool_call_rate, latency=args.openai_latency, **fake_options).start()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        configure_environment(args, asana, twilio, openai, tmp)
+        os.chdir(REPO_ROOT)
+        port = free_port()
+        server, thread = start_api_server(port)
+        base_url = f"http://127.0.0.1:{port}"
+
+        calls = {
+            "tasks": http_call(base_url, "GET", "/tasks"),
+            "chat": http_call(base_url, "POST", "/chat", json={
+                "messages": [{"role": "user", "content": "What tasks are due this week?"}]
+            }),
+            "whatsapp_send": http_call(base_url, "POST", "/whatsapp/send", json={
+                "to": "+10000000001", "message": "Benchmark message"
+            }),
+            "prompt_ai": prompt_ai_call(),
+        }
+
+        results = []
+        print(f"{'target':<14} {'conc':>5} {'reqs':>6} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8}")
+        for target in targets:
+            for level in levels:
+                row = {"target": target, "concurrency": level, **run_load(calls[target], level, args.requests)}
+                results.append(row)
+                print(f"{target:<14} {level:>5} {row['requests']:>6} {row['errors']:>6} {row['p50_ms']:>9} "
+                      f"{row['p95_ms']:>9} {row['p99_ms']:>9} {row['throughput_rps']:>8}")
+
+        server.should_exit = True
+        thread.join()
+
+    for fake in (asana, twilio, openai):
+        fake.stop()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            if not compare(results, json.load(f), args.tolerance):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
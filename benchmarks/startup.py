@@ -0,0 +1,85 @@
+"""
+Cold start benchmark
+
+Measures, each in a fresh Python process:
+- the time to import agents.py and api.py, and which SDKs the import pulled in
+- the time from importing api.py to the response of the first GET /tasks, served
+  by the local fake of the Asana API (fakes.py) so the network is left out
+
+Usage:
+    python benchmarks/startup.py [--runs 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+sdks = [name for name in ("asana", "openai", "twilio") if name in sys.modules]
+print(json.dumps({{"seconds": elapsed, "sdks": sdks}}))
+"""
+
+FIRST_REQUEST_SCRIPT = """
+import json, os, time
+from benchmarks.fakes import FakeAsana
+
+asana = FakeAsana(task_count=10).start()
+os.environ["ASANA_BASE_URL"] = asana.url
+
+started = time.perf_counter()
+import api
+from fastapi.testclient import TestClient
+with TestClient(api.app) as test_client:
+    response = test_client.get("/tasks")
+    elapsed = time.perf_counter() - started
+assert response.status_code == 200, response.text
+print(json.dumps({"seconds": elapsed}))
+"""
+
+
+def run(script, env):
+    output = subprocess.run(
+        [sys.executable, "-c", script], cwd=REPO_ROOT, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def report(name, results):
+    seconds = [result["seconds"] * 1000 for result in results]
+    line = f"{name:<28} median {statistics.median(seconds):8.1f} ms   min {min(seconds):8.1f} ms"
+    if "sdks" in results[0]:
+        line += f"   SDKs imported: {', '.join(results[0]['sdks']) or 'none'}"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="Fresh processes per measurement")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            **os.environ,
+            "PYTHONPATH": REPO_ROOT,
+            "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY", "benchmark"),
+            "ASANA_PROJECT_ID": "1",
+            "WHATSAPP_OUTBOX_PATH": os.path.join(tmp, "outbox.db"),
+        }
+        env.pop("ASANA_MIRROR_PATH", None)
+
+        for module in ("agents", "api"):
+            report(f"import {module}", [run(IMPORT_SCRIPT.format(module=module), env) for _ in range(args.runs)])
+        report("import api + first /tasks", [run(FIRST_REQUEST_SCRIPT, env) for _ in range(args.runs)])
+
+
+if __name__ == "__main__":
+    main()
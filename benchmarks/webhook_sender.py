@@ -0,0 +1,102 @@
+"""
+Local stand-in for Asana's webhook deliveries
+
+Performs the handshake of a new webhook against /asana/webhook, then sends
+events signed with the handshake's secret, as Asana would. Run against a local
+server whose ASANA_BASE_URL points at a FakeAsana (see fakes.py), so the
+changed tasks can be re-read:
+
+    python benchmarks/webhook_sender.py --url http://127.0.0.1:8000/asana/webhook \\
+        --task 1 --task 2 --action changed --field completed
+
+The server only accepts the handshake while ASANA_WEBHOOK_SECRET_PATH +
+".register" exists, so create that file first. The secret is kept in
+--secret-file so later runs skip the handshake. To start over, remove it
+together with the server's ASANA_WEBHOOK_SECRET_PATH, then create the
+registration file again.
+"""
+import argparse
+import json
+import os
+import secrets
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from asana_webhooks import sign  # noqa: E402
+
+
+class WebhookSender:
+    """Sends signed webhook deliveries to one endpoint"""
+
+    def __init__(self, url, secret=None):
+        import httpx
+
+        self.url = url
+        self.secret = secret
+        self._client = httpx.Client(timeout=30)
+
+    def handshake(self):
+        """Register a new random secret with the endpoint, as Asana does when a webhook is created"""
+        secret = secrets.token_hex(16)
+        response = self._client.post(self.url, headers={"X-Hook-Secret": secret})
+        response.raise_for_status()
+        if response.headers.get("X-Hook-Secret") != secret:
+            raise RuntimeError("The endpoint did not echo X-Hook-Secret")
+        self.secret = secret
+        return secret
+
+    def send(self, events):
+        """
+        Deliver events signed with the secret
+
+        Returns:
+            httpx.Response: The endpoint's answer, e.g. 503 when its queue is full
+        """
+        body = json.dumps({"events": events}).encode()
+        return self._client.post(self.url, content=body, headers={
+            "Content-Type": "application/json",
+            "X-Hook-Signature": sign(self.secret, body),
+        })
+
+
+def task_event(gid, action="changed", field=None, project_id="1"):
+    """An Asana webhook event about a task in the project"""
+    event = {
+        "action": action,
+        "resource": {"gid": gid, "resource_type": "task"},
+        "parent": {"gid": project_id, "resource_type": "project"} if action in ("added", "removed") else None,
+        "user": {"gid": "100", "resource_type": "user"},
+    }
+    if field:
+        event["change"] = {"field": field, "action": "changed"}
+    return event
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send signed Asana webhook events to a local server")
+    parser.add_argument("--url", default="http://127.0.0.1:8000/asana/webhook")
+    parser.add_argument("--secret-file", default=os.path.join(REPO_ROOT, "benchmarks", ".webhook_secret"),
+                        help="Where the handshake's secret is kept between runs")
+    parser.add_argument("--task", action="append", required=True, help="GID of a task the events are about")
+    parser.add_argument("--action", default="changed", choices=("added", "changed", "removed", "deleted"))
+    parser.add_argument("--field", help="Changed field, e.g. completed")
+    parser.add_argument("--project", default="1", help="GID of the project, the parent of added and removed tasks")
+    args = parser.parse_args()
+
+    secret = None
+    if os.path.exists(args.secret_file):
+        with open(args.secret_file) as f:
+            secret = f.read().strip()
+    sender = WebhookSender(args.url, secret)
+    if secret is None:
+        with open(args.secret_file, "w") as f:
+            f.write(sender.handshake())
+
+    response = sender.send([task_event(gid, args.action, args.field, args.project) for gid in args.task])
+    print(response.status_code, response.text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from history import as_dict
+from task_cache import TTLCache
+
+
+class ChatSessionStore:
+    """
+    Server-side conversation histories of /chat sessions, keyed by session id
+
+    Histories, including the tool calls and tool results the frontend never sees,
+    are kept in an in-memory LRU cache whose entries expire after `ttl` seconds
+    without a turn. With `db_path`, every saved history is also written to
+    SQLite, so sessions survive restarts and are shared by the worker processes
+    of one server. Each save bumps the session's version, and a cached history is
+    only used while its version matches the database.
+    """
+
+    def __init__(self, max_sessions=1000, ttl=86400, db_path=None):
+        self._cache = TTLCache(max_entries=max_sessions, ttl=ttl)
+        self.ttl = ttl
+        self._conn = None
+        self._lock = threading.Lock()
+        if db_path:
+            self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+            with self._lock, self._conn:
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS chat_sessions (
+                        id TEXT PRIMARY KEY,
+                        version INTEGER NOT NULL,
+                        messages TEXT NOT NULL,
+                        updated_at REAL NOT NULL
+                    )
+                    """
+                )
+                self._conn.execute(
+                    "CREATE INDEX IF NOT EXISTS chat_sessions_updated ON chat_sessions (updated_at)"
+                )
+
+    def load(self, session_id):
+        """
+        Return a copy of the session's history
+
+        Returns:
+            list: The messages as dicts, or None for an unknown or expired session
+        """
+        cached = self._cache.get(session_id)
+        if self._conn is None:
+            return list(cached[1]) if cached is not None else None
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT version FROM chat_sessions WHERE id = ? AND updated_at >= ?",
+                (session_id, time.time() - self.ttl),
+            ).fetchone()
+            if row is None:
+                return None
+            if cached is not None and cached[0] == row[0]:
+                return list(cached[1])
+            # Not cached here, or another worker saved a newer version
+            version, data = self._conn.execute(
+                "SELECT version, messages FROM chat_sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+        messages = json.loads(data)
+        self._cache.set(session_id, (version, messages))
+        return list(messages)
+
+    def save(self, session_id, messages):
+        """Store the session's history, converting OpenAI SDK message objects to dicts"""
+        messages = [as_dict(message) for message in messages]
+        version = 0
+        if self._conn is not None:
+            with self._lock, self._conn:
+                row = self._conn.execute(
+                    """
+                    INSERT INTO chat_sessions (id, version, messages, updated_at) VALUES (?, 1, ?, ?)
+                    ON CONFLICT (id) DO UPDATE SET
+                        version = version + 1, messages = excluded.messages, updated_at = excluded.updated_at
+                    RETURNING version
+                    """,
+                    (session_id, json.dumps(messages), time.time()),
+                ).fetchone()
+                version = row[0]
+                # Drop expired sessions
+                self._conn.execute("DELETE FROM chat_sessions WHERE updated_at < ?", (time.time() - self.ttl,))
+        self._cache.set(session_id, (version, messages))
+
+    def delete(self, session_id):
+        self._cache.delete(session_id)
+        if self._conn is not None:
+            with self._lock, self._conn:
+                self._conn.execute("DELETE FROM chat_sessions WHERE id = ?", (session_id,))
+
+
+# Sessions of the HTTP API. Set CHAT_SESSION_DB_PATH to persist them in SQLite
+chat_sessions = ChatSessionStore(
+    max_sessions=int(os.getenv("CHAT_SESSION_CACHE_SIZE", "1000")),
+    ttl=float(os.getenv("CHAT_SESSION_TTL", "86400")),
+    db_path=os.getenv("CHAT_SESSION_DB_PATH"),
+)
@@ -0,0 +1,162 @@
+from functools import wraps
+import os
+import threading
+from asana_limiter import asana_limiter
+from metrics import track
+
+# The Asana, OpenAI and Twilio SDKs are slow to import and their clients are
+# built on first use, so code paths that never touch a service don't pay for it.
+# Environment variables are read when a client is first built, i.e. after
+# load_dotenv() has run in the importing module.
+
+
+def http_pool_settings():
+    """
+    Connection pool settings shared by the Asana, OpenAI and Twilio clients
+
+    Each client keeps up to HTTP_POOL_SIZE connections per host open, so calls
+    running in parallel on the API's I/O pool neither queue for a connection nor
+    open and discard extra ones. Keep it at least at API_IO_WORKERS and
+    ASANA_CONCURRENCY_MAX.
+
+    Returns:
+        dict: pool_size, the connections kept per host, and keepalive_expiry, the
+            seconds an idle OpenAI connection stays open (urllib3 and requests keep
+            idle connections until the server closes them)
+    """
+    return {
+        "pool_size": int(os.getenv("HTTP_POOL_SIZE", "50")),
+        "keepalive_expiry": float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60")),
+    }
+
+
+def _httpx_options():
+    import httpx
+    settings = http_pool_settings()
+    limits = httpx.Limits(
+        max_connections=settings["pool_size"],
+        max_keepalive_connections=settings["pool_size"],
+        keepalive_expiry=settings["keepalive_expiry"],
+    )
+    # The OpenAI SDK's own clients follow redirects too
+    return {"limits": limits, "follow_redirects": True}
+
+
+def provider(factory):
+    """
+    Turn a client factory into a function that returns one shared instance
+
+    The instance is created by the first call; concurrent first calls from
+    several threads still create it only once.
+    """
+    instance = None
+    lock = threading.Lock()
+
+    @wraps(factory)
+    def get():
+        nonlocal instance
+        if instance is None:
+            with lock:
+                if instance is None:
+                    instance = factory()
+        return instance
+
+    return get
+
+
+@provider
+def openai_client():
+    """The blocking OpenAI client, used by the CLI agent"""
+    import httpx
+    from openai import OpenAI
+    return OpenAI(http_client=httpx.Client(**_httpx_options()))
+
+
+@provider
+def async_openai_client():
+    """The async OpenAI client, used by the API so completions are awaited on the event loop"""
+    import httpx
+    from openai import AsyncOpenAI
+    return AsyncOpenAI(http_client=httpx.AsyncClient(**_httpx_options()))
+
+
+@provider
+def asana_api_client():
+    """The Asana API client, authenticated with ASANA_ACCESS_TOKEN"""
+    import asana
+    configuration = asana.Configuration()
+    configuration.access_token = os.getenv('ASANA_ACCESS_TOKEN', '')
+    # ASANA_BASE_URL points the client at another server, e.g. a local fake for benchmarks
+    if os.getenv("ASANA_BASE_URL"):
+        configuration.host = os.getenv("ASANA_BASE_URL")
+    # The default of 5 connections per CPU is below the limiter's maximum concurrency
+    configuration.connection_pool_maxsize = http_pool_settings()["pool_size"]
+    api_client = asana.ApiClient(configuration)
+
+    # Every Asana API method, including page iterators, goes through call_api, so
+    # wrapping it covers all Asana calls. Each attempt is timed under the templated
+    # path, e.g. "GET /projects/{project_gid}/tasks", and all calls share the
+    # adaptive limiter, which also retries rate-limited and failed reads
+    call_api = api_client.call_api
+
+    def limited_call_api(resource_path, method, *args, **kwargs):
+        def attempt():
+            with track("asana", f"{method} {resource_path}"):
+                return call_api(resource_path, method, *args, **kwargs)
+
+        return asana_limiter.call(attempt, idempotent=method == "GET")
+
+    api_client.call_api = limited_call_api
+    return api_client
+
+
+@provider
+def tasks_api():
+    import asana
+    return asana.TasksApi(asana_api_client())
+
+
+@provider
+def stories_api():
+    import asana
+    return asana.StoriesApi(asana_api_client())
+
+
+@provider
+def events_api():
+    import asana
+    return asana.EventsApi(asana_api_client())
+
+
+@provider
+def batch_api():
+    import asana
+    return asana.BatchAPIApi(asana_api_client())
+
+
+@provider
+def twilio_client():
+    """The Twilio client used to send WhatsApp messages"""
+    from requests.adapters import HTTPAdapter
+    from twilio.http.http_client import TwilioHttpClient
+    from twilio.rest import Client
+    http_client = TwilioHttpClient()
+    adapter = HTTPAdapter(pool_maxsize=http_pool_settings()["pool_size"])
+    http_client.session.mount("https://", adapter)
+    http_client.session.mount("http://", adapter)
+    client = Client(
+        os.getenv("TWILIO_ACCOUNT_SID", ""), os.getenv("TWILIO_AUTH_TOKEN", ""), http_client=http_client
+    )
+    # TWILIO_BASE_URL points the client at another server, e.g. a local fake for benchmarks
+    if os.getenv("TWILIO_BASE_URL"):
+        client.api.base_url = os.getenv("TWILIO_BASE_URL")
+    return client
+
+
+def __getattr__(name):
+    # `except clients.ApiException` only imports the Asana SDK once an exception is
+    # actually being matched
+    if name == "ApiException":
+        from asana.rest import ApiException
+        return ApiException
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
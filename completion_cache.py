@@ -0,0 +1,68 @@
+import hashlib
+import json
+import os
+
+from history import as_dict
+from task_cache import TTLCache, task_cache
+
+
+def normalize_message(message):
+    """
+    Reduce a chat message to the parts that determine the model's answer
+
+    Tool call ids are random per request, so they are left out. Whitespace is
+    collapsed everywhere and user text is case-folded, so "What's due today?" and
+    "what's due  today?" share a cache entry.
+    """
+    message = as_dict(message)
+    content = " ".join((message.get("content") or "").split())
+    if message.get("role") == "user":
+        content = content.casefold()
+    normalized = {"role": message.get("role"), "content": content}
+    if message.get("name"):
+        normalized["name"] = message["name"]
+    if message.get("tool_calls"):
+        normalized["tool_calls"] = [
+            [call["function"]["name"], call["function"]["arguments"]] for call in message["tool_calls"]
+        ]
+    return normalized
+
+
+class CompletionCache(TTLCache):
+    """
+    Cache of final assistant answers, keyed by everything the answer depends on
+
+    Only turns without side effects may be stored: the caller checks that every
+    tool the model called during the turn is read-only. Since cached answers may
+    describe task data, the cache is cleared whenever a task is written or the
+project mirror picks up a change.
+    """
+
+    @staticmethod
+    def make_key(model, tools_json, messages):
+        """
+        Build the cache key of a turn
+
+        Args:
+            model (str): The OpenAI model
+            tools_json (str): The serialized tool schemas offered to the model
+            messages (list): The conversation, including earlier tool results
+
+        Returns:
+            str: A SHA-256 hex digest of the canonical JSON of the inputs
+        """
+        canonical = json.dumps(
+            [model, tools_json, [normalize_message(message) for message in messages]],
+            sort_keys=True,
+            separators=(",", ":"),
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+# Shared cache used by both the CLI agent and the HTTP API. COMPLETION_CACHE_TTL=0 disables it.
+# Answers are built from cached task data, so by default they expire with it
+completion_cache = CompletionCache(
+    max_entries=int(os.getenv("COMPLETION_CACHE_SIZE", "512")),
+    ttl=float(os.getenv("COMPLETION_CACHE_TTL", task_cache.ttl)),
+)
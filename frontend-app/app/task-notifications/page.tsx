@@ -59,7 +59,7 @@ export default function TaskNotifications() {
         notification
       );
       setSuccess(
-        `Notification sent successfully! SID: ${response.data.message_sid}`
+        `Notification queued for delivery! ID: ${response.data.message_id}`
       );
       setNotification({
         to: "",
@@ -1,7 +1,6 @@
 "use client";
 
 import { useState, useRef, useEffect } from "react";
-import axios from "axios";
 
 const API_URL = process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000";
 
@@ -10,9 +9,46 @@ interface ChatMessage {
   content: string;
 }
 
-interface ApiMessage {
-  role: string;
-  content: string;
+interface StreamEventData {
+  content?: string;
+  detail?: string;
+  has_tool_calls?: boolean;
+  session_id?: string;
+}
+
+interface StreamEvent {
+  event: string;
+  data: StreamEventData;
+}
+
+// Parse the server-sent events of /chat/stream as they arrive
+async function* readChatStream(
+  body: ReadableStream<Uint8Array>
+): AsyncGenerator<StreamEvent> {
+  const reader = body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    // Events are separated by a blank line
+    let boundary;
+    while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+      const rawEvent = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+
+      let event = "message";
+      let data = "";
+      for (const line of rawEvent.split("\n")) {
+        if (line.startsWith("event: ")) event = line.slice(7);
+        else if (line.startsWith("data: ")) data += line.slice(6);
+      }
+      yield { event, data: data ? JSON.parse(data) : {} };
+    }
+  }
 }
 
 export default function AssistantChat() {
@@ -20,6 +56,8 @@ export default function AssistantChat() {
   const [input, setInput] = useState("");
   const [loading, setLoading] = useState(false);
   const messagesEndRef = useRef<HTMLDivElement>(null);
+  // The server keeps the conversation history, so only new messages are sent
+  const sessionId = useRef<string>(crypto.randomUUID());
 
   // Scroll to bottom of messages
   const scrollToBottom = () => {
@@ -39,32 +77,49 @@ export default function AssistantChat() {
     setInput("");
     setLoading(true);
 
-    try {
-      // Format the messages for the API
-      const apiMessages: ApiMessage[] = [...messages, userMessage].map(
-        (msg) => ({
-          role: msg.role,
-          content: msg.content,
-        })
-      );
+    // Whether the assistant message being streamed has been added yet
+    let started = false;
+    const updateAssistantMessage = (update: (content: string) => string) => {
+      if (!started) {
+        started = true;
+        setLoading(false);
+        setMessages((prev) => [...prev, { role: "assistant", content: update("") }]);
+        return;
+      }
+      setMessages((prev) => {
+        const last = prev[prev.length - 1];
+        return [...prev.slice(0, -1), { ...last, content: update(last.content) }];
+      });
+    };
 
-      const response = await axios.post(`${API_URL}/chat`, {
-        messages: apiMessages,
+    try {
+      // Stream the reply so tokens show up as soon as the model produces them
+      const response = await fetch(`${API_URL}/chat/stream`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({
+          session_id: sessionId.current,
+          message: userMessage.content,
+        }),
       });
+      if (!response.ok || !response.body) {
+        throw new Error(`Chat request failed with status ${response.status}`);
+      }
 
-      setMessages((prev) => [
-        ...prev,
-        { role: "assistant", content: response.data.response },
-      ]);
+      for await (const { event, data } of readChatStream(response.body)) {
+        if (event === "token") {
+          updateAssistantMessage((content) => content + (data.content ?? ""));
+        } else if (event === "error") {
+          throw new Error(data.detail);
+        }
+        // tool_calls events need no handling: the server runs the tools, and the
+        // loading indicator stays up until the answer starts streaming
+      }
     } catch (err) {
       console.error("Error sending message:", err);
-      setMessages((prev) => [
-        ...prev,
-        {
-          role: "assistant",
-          content: "Sorry, I encountered an error. Please try again later.",
-        },
-      ]);
+      updateAssistantMessage(
+        () => "Sorry, I encountered an error. Please try again later."
+      );
     } finally {
       setLoading(false);
     }
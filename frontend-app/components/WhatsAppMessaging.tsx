@@ -33,7 +33,7 @@ export default function WhatsAppMessaging() {
     try {
       const response = await axios.post(`${API_URL}/whatsapp/send`, message);
       setSuccess(
-        `Message sent successfully! SID: ${response.data.message_sid}`
+        `Message queued for delivery! ID: ${response.data.message_id}`
       );
       setMessage({ to: "", message: "" }); // Clear form
     } catch (err: unknown) {
@@ -0,0 +1,175 @@
+from functools import lru_cache
+import json
+import os
+
+try:
+    import tiktoken
+except ImportError:  # Token counts fall back to an estimate without tiktoken
+    tiktoken = None
+
+# Maximum number of prompt tokens the conversation history may use
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "6000"))
+# Number of most recent turns that are always kept in full
+HISTORY_KEEP_TURNS = int(os.getenv("HISTORY_KEEP_TURNS", "4"))
+# Tool outputs in older turns are shortened to this many characters
+STALE_TOOL_OUTPUT_CHARS = int(os.getenv("STALE_TOOL_OUTPUT_CHARS", "400"))
+# Length limit for each earlier user request quoted in the summary of dropped turns
+SUMMARY_REQUEST_CHARS = 120
+# Number of dropped user requests quoted in the summary, most recent first
+SUMMARY_MAX_REQUESTS = 10
+
+# Start of the summary that replaces dropped turns. A later trim recognizes its own
+# summary by it and folds it into the next one instead of keeping it as a fixed system message
+SUMMARY_MARKER = "[Earlier conversation]"
+
+# Tokens the chat format adds around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@lru_cache(maxsize=None)
+def _encoding(model):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def as_dict(message):
+    """Return a chat message as a dict, converting OpenAI SDK message objects"""
+    if isinstance(message, dict):
+        return message
+    return message.model_dump(exclude_none=True)
+
+
+def count_tokens(message, model="gpt-4o"):
+    """
+    Count the prompt tokens of one chat message
+
+    Uses tiktoken when it is installed and otherwise estimates four characters per token.
+    """
+    message = as_dict(message)
+    text = message.get("content") or ""
+    if message.get("tool_calls"):
+        text += json.dumps(message["tool_calls"])
+
+    if tiktoken is not None:
+        return len(_encoding(model).encode(text)) + MESSAGE_OVERHEAD_TOKENS
+    return len(text) // 4 + MESSAGE_OVERHEAD_TOKENS
+
+
+def _is_summary(message):
+    message = as_dict(message)
+    return message.get("role") == "system" and (message.get("content") or "").startswith(SUMMARY_MARKER)
+
+
+def _split_turns(messages):
+    """
+    Split messages into the leading system messages, the summary of an earlier trim
+    (or None), and turns that each start with a user message
+    """
+    start = 0
+    while start < len(messages) and as_dict(messages[start]).get("role") == "system":
+        start += 1
+
+    system_messages = [message for message in messages[:start] if not _is_summary(message)]
+    summaries = [message for message in messages[:start] if _is_summary(message)]
+    turns = []
+    for message in messages[start:]:
+        if as_dict(message).get("role") == "user" or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return system_messages, (summaries[-1] if summaries else None), turns
+
+
+def _shrink_tool_output(message):
+    message = as_dict(message)
+    content = message.get("content") or ""
+    if message.get("role") != "tool" or len(content) <= STALE_TOOL_OUTPUT_CHARS:
+        return message
+    omitted = len(content) - STALE_TOOL_OUTPUT_CHARS
+    return {**message, "content": f"{content[:STALE_TOOL_OUTPUT_CHARS]}... [{omitted} characters omitted]"}
+
+
+def _parse_summary(summary):
+    """Return the number of turns and the quoted requests of an earlier summary"""
+    if summary is None:
+        return 0, []
+    lines = as_dict(summary)["content"].split("\n")
+    words = lines[0][len(SUMMARY_MARKER):].split()
+    count = int(words[0]) if words and words[0].isdigit() else 0
+    return count, [line for line in lines[1:] if line.startswith("- ")]
+
+
+def _summarize(turns, previous=None):
+    """Summarize dropped turns, folding in the summary of an earlier trim"""
+    previous_count, requests = _parse_summary(previous)
+    for turn in turns[-SUMMARY_MAX_REQUESTS:]:
+        first = as_dict(turn[0])
+        if first.get("role") == "user":
+            request = " ".join((first.get("content") or "").split())
+            if len(request) > SUMMARY_REQUEST_CHARS:
+                request = request[:SUMMARY_REQUEST_CHARS] + "..."
+            requests.append(f"- {request}")
+    requests = requests[-SUMMARY_MAX_REQUESTS:]
+    summary = (
+        f"{SUMMARY_MARKER} {previous_count + len(turns)} earlier turns of this conversation "
+        "were omitted to save space."
+    )
+    if requests:
+        summary += " Most recently in them the user asked:\n" + "\n".join(requests)
+    return {"role": "system", "content": summary}
+
+
+def fit_history(messages, budget=None, keep_turns=None, model="gpt-4o"):
+    """
+    Fit a conversation into a token budget
+
+    The leading system messages and the most recent `keep_turns` turns are always
+    kept. Tool outputs in older turns are shortened first. If the conversation is
+    still over budget, the oldest turns are dropped and replaced by a short summary
+    of what the user asked in them. Turns are kept or dropped whole, so tool
+    messages always stay together with the tool calls they answer. Trimming a
+    conversation again merges the earlier summary into the new one, so repeated
+    trims stay within the budget.
+
+    Args:
+        messages (list): Chat messages as dicts or OpenAI SDK message objects
+        budget (int, optional): Token budget, HISTORY_TOKEN_BUDGET by default
+        keep_turns (int, optional): Recent turns to keep in full, HISTORY_KEEP_TURNS by default
+        model (str): Model whose tokenizer is used for counting
+
+    Returns:
+        list: The messages to send, the input list itself if it already fits
+    """
+    budget = HISTORY_TOKEN_BUDGET if budget is None else budget
+    keep_turns = HISTORY_KEEP_TURNS if keep_turns is None else keep_turns
+
+    def total(items):
+        return sum(count_tokens(message, model) for message in items)
+
+    if total(messages) <= budget:
+        return messages
+
+    system_messages, previous_summary, turns = _split_turns(messages)
+    recent = turns[-keep_turns:] if keep_turns else []
+    older = [[_shrink_tool_output(message) for message in turn] for turn in turns[:len(turns) - len(recent)]]
+
+    recent_messages = [message for turn in recent for message in turn]
+    fixed_tokens = total(system_messages) + total(recent_messages)
+
+    # Drop the oldest turns until the rest, plus a summary of what was dropped, fits
+    def summary_for(dropped):
+        if not dropped and previous_summary is None:
+            return []
+        return [_summarize(older[:dropped], previous_summary)]
+
+    dropped = 0
+    older_tokens = [total(turn) for turn in older]
+    while dropped < len(older):
+        if fixed_tokens + total(summary_for(dropped)) + sum(older_tokens[dropped:]) <= budget:
+            break
+        dropped += 1
+
+    kept = [message for turn in older[dropped:] for message in turn]
+    summary = summary_for(dropped)
+    return list(system_messages) + summary + kept + recent_messages
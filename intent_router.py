@@ -0,0 +1,82 @@
+import logging
+import re
+
+from metrics import metrics, span
+
+logger = logging.getLogger(__name__)
+
+intent_routes = metrics.counter(
+    "intent_routes_total", "User messages answered by the intent router, or passed to the model", ("route",)
+)
+
+
+class IntentRouter:
+    """
+    Answers unambiguous commands such as "list my tasks" without calling the model
+
+    Routes are registered with the route() decorator. Each has a pattern that
+    must match the whole message, ignoring case, surrounding whitespace, a leading
+    "please" and trailing punctuation, so only plain commands are routed.
+    The handler gets the match and returns the answer text, or None to leave
+    the message to the model. A handler that raises also leaves the message to
+    the model, as a failing tool call would. Routes are tried in registration
+    order. Only the routes named in `enabled` are used, and None enables all of them.
+
+    A message that follows a question from the assistant, e.g. "complete 2"
+    after "Which task? 1) ... 2) ...", may answer it, so it is always left to
+    the model.
+    """
+
+    def __init__(self, enabled=None):
+        self.enabled = set(enabled) if enabled is not None else None
+        self._routes = []  # (name, compiled pattern, handler)
+
+    def route(self, name, pattern):
+        """
+        Register a handler for messages matching pattern
+
+        Args:
+            name (str): Name of the route, e.g. the tool it calls, as listed in `enabled`
+            pattern (str): Regular expression for the command, without anchors
+        """
+        compiled = re.compile(rf"(?:please\s+)?(?:{pattern})\s*[.!?]*", re.IGNORECASE)
+
+        def register(handler):
+            self._routes.append((name, compiled, handler))
+            return handler
+
+        return register
+
+    def answer(self, messages):
+        """
+        Answer the conversation's last message if it is a command one of the routes handles
+
+        Args:
+            messages (list): The conversation, as dicts
+
+        Returns:
+            tuple: (route name, answer), or None to ask the model
+        """
+        if not messages or messages[-1].get("role") != "user":
+            return None
+        text = (messages[-1].get("content") or "").strip()
+        if len(messages) > 1 and messages[-2].get("role") == "assistant" and "?" in (messages[-2].get("content") or ""):
+            intent_routes.inc(route="model")
+            return None
+        for name, pattern, handler in self._routes:
+            if self.enabled is not None and name not in self.enabled:
+                continue
+            match = pattern.fullmatch(text)
+            if match is None:
+                continue
+            try:
+                with span("agent.route", route=name):
+                    answer = handler(match)
+            except Exception:
+                logger.exception("Intent route %s failed, asking the model instead", name)
+                break
+            if answer is not None:
+                intent_routes.inc(route=name)
+                return name, answer
+        intent_routes.inc(route="model")
+        return None
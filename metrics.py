@@ -0,0 +1,280 @@
+from contextlib import contextmanager
+import bisect
+import glob
+import logging
+import os
+import threading
+import time
+
+try:
+    from opentelemetry import trace
+except ImportError:  # Spans are still timed into agent_step_seconds without OpenTelemetry
+    trace = None
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from fast local calls to slow completions
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Buckets for the number of tokens in one OpenAI request
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    """A monotonically increasing value per label combination"""
+
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+
+
+class Histogram:
+    """Counts of observed values in cumulative buckets per label combination, with their sum"""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.setdefault(key, [0] * (len(self.buckets) + 2))
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {key: list(counts) for key, counts in self._values.items()}
+        for key, counts in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts[:-1]):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', bound)])} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {counts[-1]}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}"
+
+
+class MetricsRegistry:
+    """The metrics of this process, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+def _number(text):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def merge_expositions(texts):
+    """
+    Add up the metrics of several processes, each in the Prometheus text format
+
+    Every metric here is a counter or a histogram, so the value of each sample
+    across processes is the sum of its values in each process.
+    """
+    families = {}  # metric name -> (comment lines, {sample name and labels: value})
+    family = None
+    for text in texts:
+        for line in text.splitlines():
+            if line.startswith("#"):
+                parts = line.split(" ", 3)
+                family = families.setdefault(parts[2], ([], {}))
+                if line not in family[0]:
+                    family[0].append(line)
+            elif line and family is not None:
+                key, _, value = line.rpartition(" ")
+                family[1][key] = family[1].get(key, 0) + _number(value)
+    lines = []
+    for comments, samples in families.values():
+        lines.extend(comments)
+        lines.extend(f"{key} {value}" for key, value in samples.items())
+    return "\n".join(lines) + "\n"
+
+
+class MetricsDirectory:
+    """
+    Shares the metrics of several processes, e.g. API workers, through files in one directory
+
+    A background thread writes this process's metrics to `<pid>.prom` in
+    `directory` every `interval` seconds, and once more on stop(). render()
+    adds up the files of all processes, including ones that have exited, so
+    counters keep increasing whichever process serves the scrape.
+    """
+
+    def __init__(self, registry, directory, interval=5.0):
+        self.registry = registry
+        self.directory = directory
+        self.interval = interval
+        self._path = os.path.join(directory, f"{os.getpid()}.prom")
+        self._stop = threading.Event()
+        self._thread = None
+
+    def write(self):
+        """Write this process's metrics, replacing its previous file in one step"""
+        temporary = f"{self._path}.tmp"
+        with open(temporary, "w") as f:
+            f.write(self.registry.render())
+        os.replace(temporary, self._path)
+
+    def render(self):
+        """The metrics of all processes, with this process's current values"""
+        texts = [self.registry.render()]
+        for path in sorted(glob.glob(os.path.join(self.directory, "*.prom"))):
+            if path == self._path:
+                continue
+            try:
+                with open(path) as f:
+                    texts.append(f.read())
+            except FileNotFoundError:
+                continue
+        return merge_expositions(texts)
+
+    def start(self):
+        """Start writing this process's metrics in the background"""
+        if self._thread is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="metrics-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background writer and write this process's final metrics"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.write()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except OSError:
+                logger.exception("Writing metrics to %s failed", self.directory)
+
+
+# Shared metrics of the CLI agent and the HTTP API
+metrics = MetricsRegistry()
+
+external_call_seconds = metrics.histogram(
+    "external_call_seconds", "Latency of calls to Asana, OpenAI and Twilio", ("service", "operation")
+)
+external_call_errors = metrics.counter(
+    "external_call_errors_total", "Failed calls to Asana, OpenAI and Twilio", ("service", "operation", "error")
+)
+openai_tokens = metrics.counter(
+    "openai_tokens_total", "OpenAI tokens used", ("model", "kind")
+)
+openai_request_tokens = metrics.histogram(
+    "openai_request_tokens", "OpenAI tokens used per request", ("model", "kind"), buckets=TOKEN_BUCKETS
+)
+agent_step_seconds = metrics.histogram(
+    "agent_step_seconds", "Duration of each step of an agent turn", ("step",)
+)
+http_request_seconds = metrics.histogram(
+    "http_request_seconds", "Latency of requests to the HTTP API", ("method", "route", "status")
+)
+
+
+@contextmanager
+def track(service, operation):
+    """
+    Time a call to an external service and count it as an error if it raises
+
+    Args:
+        service (str): "asana", "openai" or "twilio"
+        operation (str): The call, e.g. "GET /projects/{project_gid}/tasks". Keep
+            it free of ids so the number of label combinations stays small
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        external_call_errors.inc(service=service, operation=operation, error=type(e).__name__)
+        raise
+    finally:
+        external_call_seconds.observe(time.perf_counter() - started, service=service, operation=operation)
+
+
+def record_token_usage(completion):
+    """Count the prompt and completion tokens of one OpenAI chat completion"""
+    usage, model = completion.usage, completion.model
+    if usage is None:
+        return
+    for kind, tokens in (("prompt", usage.prompt_tokens), ("completion", usage.completion_tokens)):
+        openai_tokens.inc(tokens, model=model, kind=kind)
+        openai_request_tokens.observe(tokens, model=model, kind=kind)
+
+
+@contextmanager
+def span(step, **attributes):
+    """
+    Trace one step of an agent turn
+
+    The step is timed into agent_step_seconds, and also recorded as an OpenTelemetry
+    span when opentelemetry-api is installed and a tracer provider is configured.
+    """
+    started = time.perf_counter()
+    try:
+        if trace is None:
+            yield
+        else:
+            with trace.get_tracer(__name__).start_as_current_span(step, attributes=attributes):
+                yield
+    finally:
+        agent_step_seconds.observe(time.perf_counter() - started, step=step)
@@ -0,0 +1,84 @@
+from collections import Counter
+import threading
+
+
+def format_notification(task_name, status, due_date=None):
+    due_text = f" due on {due_date}" if due_date else ""
+    return f"Task update: '{task_name}' has been {status}{due_text}."
+
+
+def format_digest(notifications):
+    """
+    Merge task notifications into one message
+
+    A single notification keeps the usual format. Several become a summary line
+    such as "3 tasks completed, 2 created" followed by one line per task.
+    """
+    if len(notifications) == 1:
+        return format_notification(*notifications[0])
+
+    counts = Counter(status for _, status, _ in notifications)
+    summary = ", ".join(
+        f"{count} {'task' if count == 1 else 'tasks'} {status}" if index == 0 else f"{count} {status}"
+        for index, (status, count) in enumerate(counts.most_common())
+    )
+    lines = [f"Task updates: {summary}."]
+    for task_name, status, due_date in notifications:
+        due_text = f" (due {due_date})" if due_date else ""
+        lines.append(f"- '{task_name}' {status}{due_text}")
+    return "\n".join(lines)
+
+
+class NotificationCoalescer:
+    """
+    Combines the task notifications sent to one recipient into a single digest
+
+    The first notification for a recipient opens a window of `window` seconds.
+    Every notification for that recipient arriving within the window is added to
+    the same digest, which is sent when the window closes, or as soon as it holds
+    `max_batch` notifications.
+    """
+
+    def __init__(self, send, window=5.0, max_batch=10):
+        self.send = send
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = {}  # recipient -> list of (task_name, status, due_date)
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def add(self, to, task_name, status="created", due_date=None):
+        """Add a notification to the recipient's pending digest"""
+        notification = (task_name, status, due_date)
+        if self.window <= 0:
+            self.send(to, format_digest([notification]))
+            return
+
+        with self._lock:
+            pending = self._pending.setdefault(to, [])
+            pending.append(notification)
+            full = len(pending) >= self.max_batch
+            if not full and to not in self._timers:
+                timer = threading.Timer(self.window, self.flush, args=(to,))
+                timer.daemon = True
+                self._timers[to] = timer
+                timer.start()
+        if full:
+            self.flush(to)
+
+    def flush(self, to):
+        """Send the recipient's pending digest now"""
+        with self._lock:
+            notifications = self._pending.pop(to, None)
+            timer = self._timers.pop(to, None)
+        if timer is not None:
+            timer.cancel()
+        if notifications:
+            self.send(to, format_digest(notifications))
+
+    def flush_all(self):
+        """Send every pending digest, e.g. before shutting down"""
+        with self._lock:
+            recipients = list(self._pending)
+        for to in recipients:
+            self.flush(to)
@@ -0,0 +1,233 @@
+import logging
+import random
+import sqlite3
+import threading
+import time
+
+from process_lock import ProcessLock
+
+logger = logging.getLogger(__name__)
+
+# A message still marked "sending" after this many seconds was abandoned by a crashed worker
+SENDING_TIMEOUT = 300
+
+
+class TokenBucket:
+    """Blocking token-bucket rate limiter shared by the outbox workers"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Wait until a token is available and take it"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class PermanentDeliveryError(Exception):
+    """Raised by a send function when retrying the message cannot succeed"""
+
+
+class WhatsAppOutbox:
+    """
+    Persistent outbox for outgoing WhatsApp messages
+
+    enqueue() stores a message in SQLite and returns immediately. A pool of worker
+    threads sends queued messages through `send`, no faster than `rate` messages
+    per second (with bursts of up to `burst`). Failed sends are retried with
+    exponential backoff until `max_attempts` is reached. Each message records its
+    delivery status: queued, sending, sent or failed.
+
+    Messages left in "sending" by a crash are picked up again after
+    SENDING_TIMEOUT, so delivery is at least once.
+
+    Several processes, e.g. API workers, can share one outbox database. Only the
+    process holding the lock file next to the database sends messages, so the
+    rate limit applies to the sender as a whole. The others only queue messages.
+    Another process takes over sending when the sender exits.
+    """
+
+    def __init__(self, db_path, send, workers=4, rate=1.0, burst=5, max_attempts=5, base_backoff=2.0):
+        self.send = send
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self._bucket = TokenBucket(rate, burst)
+        self._wakeup = threading.Condition()
+        self._stop = threading.Event()
+        self._threads = []
+        self._start_lock = threading.Lock()
+        self._sender_lock = ProcessLock(f"{db_path}.lock")
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db_lock = threading.Lock()
+        with self._db_lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    recipient TEXT NOT NULL,
+                    body TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    sid TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS messages_pending ON messages (status, next_attempt_at)"
+            )
+
+    def enqueue(self, to, body):
+        """
+        Queue a message for delivery
+
+        Args:
+            to (str): Recipient in Twilio format, e.g. "whatsapp:+1234567890"
+            body (str): The message content
+
+        Returns:
+            int: The outbox message id, for looking up its delivery status
+        """
+        now = time.time()
+        with self._db_lock:
+            cursor = self._conn.execute(
+                "INSERT INTO messages (recipient, body, next_attempt_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (to, body, now, now, now),
+            )
+        self.start()
+        with self._wakeup:
+            self._wakeup.notify()
+        return cursor.lastrowid
+
+    def get(self, message_id):
+        """
+        Look up a message's delivery status
+
+        Returns:
+            dict: The message record, or None if the id is unknown
+        """
+        with self._db_lock:
+            cursor = self._conn.execute(
+                "SELECT id, recipient, status, attempts, sid, error, created_at, updated_at FROM messages WHERE id = ?",
+                (message_id,),
+            )
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return dict(zip([column[0] for column in cursor.description], row))
+
+    def _claim(self):
+        # BEGIN IMMEDIATE takes the write lock, so two workers (or processes) never claim the same message
+        now = time.time()
+        with self._db_lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    """
+                    SELECT id, recipient, body, attempts FROM messages
+                    WHERE (status = 'queued' AND next_attempt_at <= ?)
+                       OR (status = 'sending' AND updated_at < ?)
+                    ORDER BY next_attempt_at, id LIMIT 1
+                    """,
+                    (now, now - SENDING_TIMEOUT),
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE messages SET status = 'sending', updated_at = ? WHERE id = ?", (now, row[0])
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return row
+
+    def _update(self, message_id, **fields):
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._db_lock:
+            self._conn.execute(
+                f"UPDATE messages SET {assignments} WHERE id = ?", (*fields.values(), message_id)
+            )
+
+    def _deliver(self, message_id, to, body, attempts):
+        self._bucket.acquire()
+        attempts += 1
+        try:
+            sid = self.send(to, body)
+        except Exception as e:
+            if isinstance(e, PermanentDeliveryError) or attempts >= self.max_attempts:
+                logger.warning("Giving up on WhatsApp message %s after %d attempts: %s", message_id, attempts, e)
+                self._update(message_id, status="failed", attempts=attempts, error=str(e))
+            else:
+                # Exponential backoff with jitter
+                backoff = self.base_backoff * 2 ** (attempts - 1) * random.uniform(0.5, 1.5)
+                self._update(
+                    message_id, status="queued", attempts=attempts, error=str(e),
+                    next_attempt_at=time.time() + backoff,
+                )
+            return
+        self._update(message_id, status="sent", attempts=attempts, sid=sid, error=None)
+
+    def _is_sender(self):
+        """Whether this process sends the queued messages, taking over the lock file if it is free"""
+        if self._sender_lock.held:
+            return True
+        if not self._sender_lock.try_acquire():
+            return False
+        logger.info("Process sends the queued WhatsApp messages")
+        return True
+
+    def _work(self):
+        while not self._stop.is_set():
+            row = None
+            # Another process sends the queued messages, so only check whether it exited
+            if self._is_sender():
+                try:
+                    row = self._claim()
+                except sqlite3.OperationalError:
+                    logger.exception("Claiming an outbox message failed")
+            if row is None:
+                # Sleep until a new message is queued, or poll for retries that became due
+                with self._wakeup:
+                    self._wakeup.wait(timeout=1.0)
+                continue
+            self._deliver(*row)
+
+    def start(self):
+        """Start the worker pool if it is not running yet"""
+        with self._start_lock:
+            if self._threads:
+                return
+            self._stop.clear()
+            for number in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"whatsapp-outbox-{number}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self):
+        """Stop the workers after their current message"""
+        self._stop.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self._sender_lock.release()
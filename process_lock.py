@@ -0,0 +1,52 @@
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Without file locks every process holds the lock
+    fcntl = None
+
+
+class ProcessLock:
+    """
+    Non-blocking lock held by at most one process, e.g. one API worker
+
+    The lock is an flock on `path`, so the operating system releases it when
+    the holding process exits and another process can take over by calling
+    try_acquire() again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    @property
+    def held(self):
+        """Whether this process holds the lock"""
+        return fcntl is None or self._file is not None
+
+    def try_acquire(self):
+        """
+        Take the lock if no other process holds it
+
+        Returns:
+            bool: Whether this process now holds the lock
+        """
+        with self._lock:
+            if self.held:
+                return True
+            lock_file = open(self.path, "a")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+            self._file = lock_file
+            return True
+
+    def release(self):
+        """Give up the lock, if this process holds it"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
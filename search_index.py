@@ -0,0 +1,113 @@
+from collections import Counter, defaultdict
+import heapq
+import math
+import re
+import threading
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall((text or "").lower())
+
+
+class TaskSearchIndex:
+    """
+    In-memory inverted index over task names and notes, ranked with BM25
+
+    Name terms count `name_weight` times so a match in the title outranks a
+    passing mention in the notes. Tasks are added, replaced and removed one at a
+    time, so the index can follow the project mirror incrementally.
+    """
+
+    def __init__(self, k1=1.2, b=0.75, name_weight=2):
+        self.k1 = k1
+        self.b = b
+        self.name_weight = name_weight
+        self._postings = defaultdict(dict)  # term -> {gid: term frequency}
+        self._doc_terms = {}  # gid -> Counter of terms, used to remove old postings
+        self._doc_lengths = {}  # gid -> number of weighted terms
+        self._docs = {}  # gid -> task record returned in results
+        self._total_length = 0
+        self._lock = threading.Lock()
+        self.ready = False
+
+    def __len__(self):
+        return len(self._docs)
+
+    def _remove(self, gid):
+        terms = self._doc_terms.pop(gid, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self._postings[term]
+            postings.pop(gid, None)
+            if not postings:
+                del self._postings[term]
+        self._total_length -= self._doc_lengths.pop(gid)
+        del self._docs[gid]
+
+    def _add(self, task):
+        gid = task["gid"]
+        self._remove(gid)
+        terms = Counter(tokenize(task.get("notes")))
+        for term in tokenize(task.get("name")):
+            terms[term] += self.name_weight
+        for term, frequency in terms.items():
+            self._postings[term][gid] = frequency
+        self._doc_terms[gid] = terms
+        self._docs[gid] = task
+        self._doc_lengths[gid] = sum(terms.values())
+        self._total_length += self._doc_lengths[gid]
+
+    def apply_changes(self, tasks, removed=(), reset=False):
+        """
+        Update the index
+
+        Args:
+            tasks (list): Task records to add or replace
+            removed (iterable): GIDs of tasks to drop
+            reset (bool): Whether `tasks` is the complete set of tasks, replacing the index
+        """
+        with self._lock:
+            if reset:
+                self._postings.clear()
+                self._doc_terms.clear()
+                self._doc_lengths.clear()
+                self._docs.clear()
+                self._total_length = 0
+                self.ready = True
+            for gid in removed:
+                self._remove(gid)
+            for task in tasks:
+                self._add(task)
+
+    def search(self, query, limit=20):
+        """
+        Rank indexed tasks against a query
+
+        Args:
+            query (str): Search terms
+            limit (int): Maximum number of tasks to return
+
+        Returns:
+            list: Matching task records, best match first
+        """
+        with self._lock:
+            doc_count = len(self._docs)
+            if not doc_count:
+                return []
+            average_length = self._total_length / doc_count
+
+            scores = defaultdict(float)
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for gid, frequency in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[gid] / average_length)
+                    scores[gid] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+            ranked = heapq.nlargest(limit, scores, key=scores.get)
+            return [self._docs[gid] for gid in ranked]
@@ -0,0 +1,74 @@
+"""
+Production entry point of the HTTP API
+
+Serves api:app in several uvicorn worker processes, without the reloader that
+`python api.py` runs for development:
+
+    python serve.py
+
+Settings:
+    API_HOST, API_PORT: Address to listen on (0.0.0.0:8000)
+    API_WORKERS: Worker processes (one per CPU)
+    API_KEEPALIVE_TIMEOUT: Seconds an idle client connection is kept open (5)
+    API_IO_WORKERS, HTTP_POOL_SIZE, HTTP_KEEPALIVE_EXPIRY: Per-worker I/O threads
+        and outbound connection pools, see api.py and clients.py
+    METRICS_DIR: Directory through which the workers share their metrics (a new
+        temporary directory)
+
+Each worker has its own caches and Asana limiter, so ASANA_CONCURRENCY_MAX
+applies per worker. One worker sends the WhatsApp outbox, so
+WHATSAPP_MESSAGES_PER_SECOND applies to the server as a whole. Set
+CHAT_SESSION_DB_PATH so chat sessions are shared by the workers. With
+ASANA_MIRROR_PATH set, one worker refreshes the task mirror and the others
+rebuild their search index from its database within ASANA_MIRROR_POLL_SECONDS.
+
+Each worker counts its own metrics and writes them to METRICS_DIR every few
+seconds. Whichever worker answers a scrape of /metrics returns the totals of
+all workers, so scrape the server as one target.
+"""
+import glob
+import logging
+import os
+import tempfile
+
+from dotenv import load_dotenv
+
+logger = logging.getLogger("serve")
+
+
+def main():
+    import uvicorn
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+    host = os.getenv("API_HOST", "0.0.0.0")
+    port = int(os.getenv("API_PORT", "8000"))
+    workers = int(os.getenv("API_WORKERS", str(os.cpu_count() or 1)))
+    keepalive_timeout = int(os.getenv("API_KEEPALIVE_TIMEOUT", "5"))
+
+    logger.info(
+        "Serving on %s:%d with %d workers, client connections kept alive %ds",
+        host, port, workers, keepalive_timeout,
+    )
+    if workers > 1 and not os.getenv("CHAT_SESSION_DB_PATH"):
+        logger.warning("CHAT_SESSION_DB_PATH is not set, so each worker only knows its own chat sessions")
+
+    # The workers inherit METRICS_DIR. Metrics left by an earlier run are removed so totals start at zero
+    metrics_dir = os.environ.setdefault("METRICS_DIR", tempfile.mkdtemp(prefix="api-metrics-"))
+    os.makedirs(metrics_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(metrics_dir, "*.prom")):
+        os.remove(path)
+
+    uvicorn.run(
+        "api:app",
+        host=host,
+        port=port,
+        workers=workers,
+        reload=False,
+        timeout_keep_alive=keepalive_timeout,
+    )
+
+
+if __name__ == "__main__":
+    main()
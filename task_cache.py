@@ -0,0 +1,161 @@
+from collections import OrderedDict
+import os
+import threading
+import time
+
+
+class _Flight:
+    """A load in progress in get_or_load, whose result is shared by every caller asking for its key"""
+
+    def __init__(self, generation):
+        self.generation = generation
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache:
+    """
+    Thread-safe in-process cache with TTL expiry and LRU eviction
+
+    Every entry expires after `ttl` seconds and the least recently used entry is
+    evicted once `max_entries` is reached.
+    """
+
+    def __init__(self, max_entries=256, ttl=30):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight = {}  # key -> _Flight
+        # Bumped whenever entries are dropped, so loads started before are neither joined nor cached
+        self._generation = 0
+
+    def get(self, key):
+        """
+        Look up a cached value
+
+        Args:
+            key: A hashable key
+
+        Returns:
+            The cached value, or None if the key is missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            # Mark as most recently used
+            self._entries.move_to_end(key)
+            return value
+
+    def _store(self, key, value):
+        # Called with the lock held
+        if self.ttl <= 0 or self.max_entries <= 0:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _forget_inflight(self):
+        # Called with the lock held after dropping entries
+        self._inflight.clear()
+        self._generation += 1
+
+    def set(self, key, value):
+        with self._lock:
+            self._store(key, value)
+
+    def get_or_load(self, key, loader):
+        """
+        Return the cached value for key, calling loader() and caching its result on a miss
+
+        Concurrent misses for the same key share one loader() call: the first caller
+        runs it and the others wait for its result, or its exception. This holds even
+        with caching disabled (ttl=0). Exceptions raised by loader are not cached.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight(self._generation)
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = loader()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._inflight.get(key) is flight:
+                    del self._inflight[key]
+                # A result loaded across an invalidation may predate the write that caused it
+                if flight.error is None and flight.value is not None and flight.generation == self._generation:
+                    self._store(key, flight.value)
+            flight.done.set()
+        return flight.value
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._forget_inflight()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._forget_inflight()
+
+
+class TaskCache(TTLCache):
+    """
+    In-process read-through cache for Asana task reads
+
+    Entries are keyed either by task GID (full task records) or by query (task
+    listings and search results).
+    """
+
+    @staticmethod
+    def task_key(task_id):
+        return ("task", str(task_id))
+
+    @staticmethod
+    def query_key(kind, *params):
+        return ("query", kind) + params
+
+    def put_task(self, task):
+        """Store a full task record (e.g. the response of a create or update) under its GID"""
+        if task and task.get("gid"):
+            self.set(self.task_key(task["gid"]), task)
+
+    def invalidate_task(self, task_id=None):
+        """
+        Drop the cached record of a written task along with every cached query,
+        since any listing or search result may contain the task
+        """
+        with self._lock:
+            if task_id is not None:
+                self._entries.pop(self.task_key(task_id), None)
+            for key in [key for key in self._entries if key[0] == "query"]:
+                del self._entries[key]
+            self._forget_inflight()
+
+
+# Shared cache used by both the CLI agent and the HTTP API
+task_cache = TaskCache(
+    max_entries=int(os.getenv("TASK_CACHE_SIZE", "256")),
+    ttl=float(os.getenv("TASK_CACHE_TTL", "30")),
+)
@@ -0,0 +1,294 @@
+from datetime import datetime, timedelta, timezone
+import json
+import logging
+import sqlite3
+import threading
+import time
+import clients
+from process_lock import ProcessLock
+
+logger = logging.getLogger(__name__)
+
+# Modified-since windows overlap by this much so clock skew with Asana cannot lose a change
+SYNC_OVERLAP = timedelta(seconds=60)
+
+
+class TaskMirror:
+    """
+    Local SQLite mirror of the tasks in one Asana project
+
+    The mirror is filled by a single bulk load. After that, refresh() asks Asana's
+    events API what changed since the stored sync token and applies only those
+    deltas: removed tasks are deleted and changed tasks are re-read with one
+    modified_since listing. start() runs refresh() on a background thread.
+    `tasks_api` and `events_api` are callables returning the SDK clients, such as
+    clients.tasks_api, so building a mirror does not build the clients.
+
+    Several processes, e.g. API workers, can share one mirror database. Only the
+    process holding the lock file next to the database runs refresh(). Another
+    process takes over when it exits.
+
+    on_change, if given, is called as on_change(tasks, removed_gids, reset) after
+    every change this process makes to the mirror, with reset=True when `tasks` is
+    the whole project. Every change also bumps a version in the database. While
+    the background thread runs, it checks the version every `poll_interval`
+    seconds. When another process changed the mirror, it passes the whole
+    project to on_change again.
+    """
+
+    def __init__(self, db_path, project_id, tasks_api, events_api, fields,
+                 refresh_interval=30, on_change=None, poll_interval=1.0):
+        self.project_id = project_id
+        # Providers of the SDK clients, called when the mirror first talks to Asana
+        self._tasks_api = tasks_api
+        self._events_api = events_api
+        self.fields = fields
+        self.refresh_interval = refresh_interval
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        # Top-level keys kept from each task record, e.g. "assignee" for "assignee.name"
+        self._keys = {"gid"} | {field.split(".")[0] for field in fields.split(",")}
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        # Version of the mirror last handed to on_change
+        self._version = None
+        # Held by the one process that refreshes the mirror
+        self._refresher_lock = ProcessLock(f"{db_path}.lock")
+        # Other processes may hold the write lock for a whole refresh
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS tasks (gid TEXT PRIMARY KEY, position INTEGER, data TEXT)"
+            )
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def _get_meta(self, key):
+        row = self._conn.execute(
+            "SELECT value FROM meta WHERE key = ?", (f"{self.project_id}:{key}",)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (f"{self.project_id}:{key}", value)
+        )
+
+    def _bump_version(self, reset=False):
+        # Called in a write transaction. A reset hands the whole project to on_change,
+        # so it brings this process up to date; other changes only do if it already was
+        previous = self._get_meta("version") or "0"
+        version = str(int(previous) + 1)
+        if reset or self._version == previous:
+            self._version = version
+        self._set_meta("version", version)
+
+    def _project(self, task):
+        return {key: value for key, value in task.items() if key in self._keys}
+
+    def _upsert(self, task):
+        # Keep a task's position when it is already mirrored, new tasks go to the end
+        self._conn.execute(
+            """
+            INSERT INTO tasks (gid, position, data)
+            VALUES (?, (SELECT COALESCE(MAX(position), -1) + 1 FROM tasks), ?)
+            ON CONFLICT(gid) DO UPDATE SET data = excluded.data
+            """,
+            (task["gid"], json.dumps(self._project(task))),
+        )
+
+    def _notify(self, tasks, removed=(), reset=False):
+        if self.on_change is not None:
+            self.on_change([self._project(task) for task in tasks], removed, reset)
+
+    def _new_sync_token(self):
+        # Without a sync token Asana answers 412 with a fresh token in the body
+        try:
+            response = self._events_api().get_events(self.project_id, {}, full_payload=True)
+            return response.get("sync")
+        except clients.ApiException as e:
+            if e.status == 412:
+                return json.loads(e.body)["sync"]
+            raise
+
+    def is_loaded(self):
+        """Whether the initial bulk load has completed"""
+        with self._lock:
+            return self._get_meta("sync") is not None
+
+    def bulk_load(self):
+        """Replace the mirror with a full read of the project"""
+        # Take the sync token first so changes made during the load show up in the next refresh
+        sync = self._new_sync_token()
+        started_at = datetime.now(timezone.utc)
+        tasks = list(self._tasks_api().get_tasks_for_project(
+            self.project_id, {"limit": 100, "opt_fields": self.fields}
+        ))
+
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM tasks")
+            self._conn.executemany(
+                "INSERT INTO tasks (gid, position, data) VALUES (?, ?, ?)",
+                [(task["gid"], position, json.dumps(self._project(task))) for position, task in enumerate(tasks)],
+            )
+            self._set_meta("sync", sync)
+            self._set_meta("synced_at", started_at.isoformat())
+            self._bump_version(reset=True)
+        self._notify(tasks, reset=True)
+        logger.info("Mirrored %d tasks from project %s", len(tasks), self.project_id)
+
+    def refresh(self):
+        """Apply the changes made in Asana since the last bulk load or refresh"""
+        with self._lock:
+            sync = self._get_meta("sync")
+            synced_at = self._get_meta("synced_at")
+        if sync is None:
+            self.bulk_load()
+            return
+
+        started_at = datetime.now(timezone.utc)
+        changed, removed = set(), set()
+        has_more = True
+        try:
+            while has_more:
+                response = self._events_api().get_events(self.project_id, {"sync": sync}, full_payload=True)
+                sync = response["sync"]
+                has_more = response.get("has_more", False)
+                for event in response["data"]:
+                    resource = event.get("resource") or {}
+                    if resource.get("resource_type") != "task":
+                        continue
+                    parent = event.get("parent") or {}
+                    if event["action"] == "deleted" or (
+                        event["action"] == "removed" and parent.get("gid") == self.project_id
+                    ):
+                        removed.add(resource["gid"])
+                        changed.discard(resource["gid"])
+                    else:
+                        changed.add(resource["gid"])
+                        removed.discard(resource["gid"])
+        except clients.ApiException as e:
+            # The sync token expired, so the events since then are lost
+            if e.status == 412:
+                self.bulk_load()
+                return
+            raise
+
+        tasks = []
+        if changed:
+            modified_since = (datetime.fromisoformat(synced_at) - SYNC_OVERLAP).isoformat()
+            tasks = [
+                task for task in self._tasks_api().get_tasks({
+                    "project": self.project_id,
+                    "modified_since": modified_since,
+                    "limit": 100,
+                    "opt_fields": self.fields,
+                })
+                if task["gid"] not in removed
+            ]
+
+        with self._lock, self._conn:
+            for task in tasks:
+                self._upsert(task)
+            self._conn.executemany("DELETE FROM tasks WHERE gid = ?", [(gid,) for gid in removed])
+            self._set_meta("sync", sync)
+            self._set_meta("synced_at", started_at.isoformat())
+            if tasks or removed:
+                self._bump_version()
+        if tasks or removed:
+            self._notify(tasks, removed)
+
+    def upsert_task(self, task):
+        """Store a task written through this service without waiting for the next refresh"""
+        if not task or not task.get("gid"):
+            return
+        with self._lock, self._conn:
+            self._upsert(task)
+            self._bump_version()
+        self._notify([task])
+
+    def remove_tasks(self, gids):
+        """Drop tasks deleted or removed from the project without waiting for the next refresh"""
+        gids = list(gids)
+        if not gids:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM tasks WHERE gid = ?", [(gid,) for gid in gids])
+            self._bump_version()
+        self._notify([], gids)
+
+    def list_tasks(self, limit=10, offset=0):
+        """
+        Read tasks from the mirror in project order
+
+        Args:
+            limit (int): Maximum number of tasks to return
+            offset (int): Number of tasks to skip
+
+        Returns:
+            list: Task records with the mirrored fields
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data FROM tasks ORDER BY position LIMIT ? OFFSET ?", (limit, offset)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def _is_refresher(self):
+        """Whether this process refreshes the mirror, taking over the lock file if it is free"""
+        if self._refresher_lock.held:
+            return True
+        if not self._refresher_lock.try_acquire():
+            return False
+        logger.info("Process refreshes the mirror of project %s", self.project_id)
+        return True
+
+    def _catch_up(self):
+        """Hand the whole project to on_change if the mirror changed since this process last did"""
+        if self.on_change is None:
+            return
+        with self._lock:
+            if self._get_meta("sync") is None:
+                return
+            # Read the version first: a change made in between only causes one more reload.
+            # Mirrors written before versions were kept count as version 0
+            version = self._get_meta("version") or "0"
+            if version == self._version:
+                return
+            rows = self._conn.execute("SELECT data FROM tasks ORDER BY position").fetchall()
+            self._version = version
+        self.on_change([json.loads(row[0]) for row in rows], (), True)
+
+    def start(self):
+        """Start the background refresher, which also performs the initial bulk load if needed"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="task-mirror", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._refresher_lock.release()
+
+    def _run(self):
+        next_refresh = 0.0
+        while not self._stop.is_set():
+            # A mirror persisted by an earlier run, or changed by another process, is
+            # handed to on_change before this process applies deltas to it
+            try:
+                self._catch_up()
+            except Exception:
+                logger.exception("Reading the task mirror failed")
+            if time.monotonic() >= next_refresh and self._is_refresher():
+                try:
+                    self.refresh()
+                except Exception:
+                    logger.exception("Refreshing the task mirror failed")
+                next_refresh = time.monotonic() + self.refresh_interval
+            self._stop.wait(self.poll_interval)
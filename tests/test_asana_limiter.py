@@ -0,0 +1,132 @@
+import threading
+import time
+
+import pytest
+
+from asana_limiter import AdaptiveLimiter
+
+
+class FakeApiError(Exception):
+    """Shaped like the Asana SDK's ApiException"""
+
+    def __init__(self, status, headers=None):
+        super().__init__(f"Asana answered {status}")
+        self.status = status
+        self.headers = headers or {}
+
+
+class FakeCall:
+    """A func for AdaptiveLimiter.call that raises the given errors in turn, then succeeds"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.called_at = []
+
+    def __call__(self):
+        self.called_at.append(time.monotonic())
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def limiter(**settings):
+    settings = {"initial_limit": 4, "base_backoff": 0, **settings}
+    return AdaptiveLimiter(**settings)
+
+
+def test_retry_after_pauses_the_retry():
+    asana = limiter()
+    func = FakeCall(FakeApiError(429, {"Retry-After": "0.2"}))
+    assert asana.call(func) == "ok"
+    assert len(func.called_at) == 2
+    assert func.called_at[1] - func.called_at[0] >= 0.2
+
+
+def test_retry_after_pauses_every_call():
+    asana = limiter()
+    asana.acquire()
+    asana.release(0.1, throttled=True, pause=0.2)
+    started = time.monotonic()
+    acquired = threading.Event()
+
+    def other_call():
+        asana.acquire()
+        acquired.set()
+
+    thread = threading.Thread(target=other_call)
+    thread.start()
+    assert acquired.wait(5)
+    thread.join()
+    assert time.monotonic() - started >= 0.15
+
+
+@pytest.mark.parametrize("error", [FakeApiError(503), FakeApiError(500), ConnectionError("reset")])
+def test_transient_failures_are_retried_only_for_idempotent_calls(error):
+    func = FakeCall(error)
+    with pytest.raises(type(error)):
+        limiter().call(func)
+    assert len(func.called_at) == 1
+
+    func = FakeCall(error)
+    assert limiter().call(func, idempotent=True) == "ok"
+    assert len(func.called_at) == 2
+
+
+def test_rate_limited_calls_are_retried_even_if_not_idempotent():
+    func = FakeCall(FakeApiError(429))
+    assert limiter().call(func) == "ok"
+    assert len(func.called_at) == 2
+
+
+def test_client_errors_are_not_retried():
+    func = FakeCall(FakeApiError(404))
+    with pytest.raises(FakeApiError):
+        limiter().call(func, idempotent=True)
+    assert len(func.called_at) == 1
+
+
+def test_retries_stop_after_max_retries():
+    func = FakeCall(*[FakeApiError(503)] * 3)
+    with pytest.raises(FakeApiError):
+        limiter(max_retries=2).call(func, idempotent=True)
+    assert len(func.called_at) == 3
+
+
+def test_fast_calls_grow_the_limit_by_about_one_per_round():
+    asana = limiter(initial_limit=4, max_limit=6)
+    for _ in range(4):
+        asana.acquire()
+        asana.release(0.1)
+    assert 4.9 < asana.limit < 5
+    for _ in range(100):
+        asana.acquire()
+        asana.release(0.1)
+    assert asana.limit == 6
+
+
+def test_throttling_halves_and_slow_calls_shrink_the_limit():
+    asana = limiter(initial_limit=8, latency_target=0.05)
+    asana.acquire()
+    asana.release(0.01, throttled=True)
+    assert asana.limit == 4
+
+    time.sleep(0.06)
+    asana.acquire()
+    asana.release(0.1)
+    assert asana.limit == pytest.approx(3.6)
+
+
+def test_failures_of_one_round_shrink_the_limit_once():
+    asana = limiter(initial_limit=8, min_limit=3)
+    for _ in range(3):
+        asana.acquire()
+    for _ in range(3):
+        asana.release(0.01, throttled=True)
+    assert asana.limit == 4
+
+
+def test_the_limit_stays_at_least_min_limit():
+    asana = limiter(initial_limit=4, min_limit=3)
+    asana.acquire()
+    asana.release(0.001, throttled=True)
+    assert asana.limit == 3
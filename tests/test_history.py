@@ -0,0 +1,25 @@
+from history import SUMMARY_MARKER, count_tokens, fit_history
+
+
+def total(messages):
+    return sum(count_tokens(message) for message in messages)
+
+
+def test_repeated_trims_stay_within_budget():
+    messages = [{"role": "system", "content": "You are a personal assistant."}]
+    for turn in range(200):
+        messages.append({"role": "user", "content": f"Request {turn}: " + "please check my tasks " * 20})
+        messages.append({"role": "assistant", "content": f"Answer {turn}: " + "here are the tasks " * 30})
+        # The CLI and saved sessions keep the trimmed history for the next turn
+        messages = fit_history(messages, budget=3000, keep_turns=2)
+        assert total(messages) <= 3000
+
+    system_messages = [message for message in messages if message["role"] == "system"]
+    assert len(system_messages) == 2
+    assert messages[0]["content"] == "You are a personal assistant."
+    summary = system_messages[1]["content"]
+    assert summary.startswith(SUMMARY_MARKER)
+    # Every dropped turn is counted once across the folded summaries
+    kept_turns = sum(1 for message in messages if message["role"] == "user")
+    assert summary.split()[2] == str(200 - kept_turns)
+    assert "Request 199" not in summary
@@ -0,0 +1,151 @@
+import threading
+
+import pytest
+
+from task_cache import TaskCache, TTLCache
+
+TIMEOUT = 5
+
+
+class CountingEvent(threading.Event):
+    """An Event that counts the threads waiting on it"""
+
+    def __init__(self):
+        super().__init__()
+        self.waiting = threading.Semaphore(0)
+
+    def wait(self, timeout=None):
+        self.waiting.release()
+        return super().wait(timeout)
+
+
+class BlockingLoader:
+    """
+    A loader that blocks until the test releases it
+
+    The first call replaces the done event of its flight with a CountingEvent,
+    so the test can wait until the other callers have joined the flight.
+    """
+
+    def __init__(self, cache, key, result=None, error=None):
+        self.cache = cache
+        self.key = key
+        self.result = result
+        self.error = error
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.done_event = None
+
+    def __call__(self):
+        self.calls += 1
+        with self.cache._lock:
+            flight = self.cache._inflight.get(self.key)
+            if flight is not None:
+                self.done_event = flight.done = CountingEvent()
+        self.started.set()
+        assert self.release.wait(TIMEOUT)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def wait_for_joiners(self, count):
+        for _ in range(count):
+            assert self.done_event.waiting.acquire(timeout=TIMEOUT)
+
+
+def run_in_threads(count, func):
+    """Call func in `count` threads, returning the threads and their results or exceptions by index"""
+    outcomes = {}
+
+    def run(index):
+        try:
+            outcomes[index] = func()
+        except Exception as e:
+            outcomes[index] = e
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, outcomes
+
+
+def start_leader(cache, loader):
+    threads, outcomes = run_in_threads(1, lambda: cache.get_or_load(loader.key, loader))
+    assert loader.started.wait(TIMEOUT)
+    return threads, outcomes
+
+
+def join(threads):
+    for thread in threads:
+        thread.join(TIMEOUT)
+        assert not thread.is_alive()
+
+
+@pytest.mark.parametrize("ttl", [30, 0])
+def test_concurrent_misses_share_one_load(ttl):
+    cache = TTLCache(ttl=ttl)
+    loader = BlockingLoader(cache, "tasks", result=["task"])
+    leader, leader_outcome = start_leader(cache, loader)
+    waiters, outcomes = run_in_threads(5, lambda: cache.get_or_load("tasks", loader))
+    loader.wait_for_joiners(5)
+
+    loader.release.set()
+    join(leader + waiters)
+    assert loader.calls == 1
+    assert leader_outcome == {0: ["task"]}
+    assert all(outcome is leader_outcome[0] for outcome in outcomes.values())
+
+
+def test_waiters_receive_the_loaders_exception():
+    cache = TTLCache()
+    error = RuntimeError("Asana is down")
+    loader = BlockingLoader(cache, "tasks", error=error)
+    leader, leader_outcome = start_leader(cache, loader)
+    waiters, outcomes = run_in_threads(3, lambda: cache.get_or_load("tasks", loader))
+    loader.wait_for_joiners(3)
+
+    loader.release.set()
+    join(leader + waiters)
+    assert loader.calls == 1
+    assert leader_outcome == {0: error}
+    assert all(outcome is error for outcome in outcomes.values())
+    # Failures are not cached, so the next call loads again
+    assert cache.get("tasks") is None
+    assert cache.get_or_load("tasks", lambda: ["task"]) == ["task"]
+
+
+@pytest.mark.parametrize("invalidate", [
+    lambda cache: cache.clear(),
+    lambda cache: cache.delete(TaskCache.query_key("list")),
+    lambda cache: cache.invalidate_task("1"),
+])
+def test_invalidation_during_a_load_is_not_undone_by_it(invalidate):
+    cache = TaskCache()
+    key = TaskCache.query_key("list")
+    stale_loader = BlockingLoader(cache, key, result=["stale"])
+    leader, leader_outcome = start_leader(cache, stale_loader)
+
+    invalidate(cache)
+    # A caller arriving after the invalidation starts its own load instead of joining the stale one
+    assert cache.get_or_load(key, lambda: ["fresh"]) == ["fresh"]
+
+    stale_loader.release.set()
+    join(leader)
+    # The caller of the stale load still gets its result, but it does not replace the fresh one
+    assert leader_outcome == {0: ["stale"]}
+    assert stale_loader.calls == 1
+    assert cache.get(key) == ["fresh"]
+
+
+def test_invalidation_during_a_load_keeps_its_result_out_of_the_cache():
+    cache = TaskCache()
+    key = TaskCache.query_key("list")
+    loader = BlockingLoader(cache, key, result=["stale"])
+    leader, leader_outcome = start_leader(cache, loader)
+
+    cache.invalidate_task("1")
+    loader.release.set()
+    join(leader)
+    assert leader_outcome == {0: ["stale"]}
+    assert cache.get(key) is None
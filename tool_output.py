@@ -0,0 +1,84 @@
+import json
+import os
+
+# Default output budget of every tool: list items shown and total characters
+DEFAULT_MAX_ITEMS = int(os.getenv("TOOL_OUTPUT_MAX_ITEMS", "20"))
+DEFAULT_MAX_CHARS = int(os.getenv("TOOL_OUTPUT_MAX_CHARS", "4000"))
+
+# Per-tool budgets. Batch results get more room so no failed operation is hidden.
+# Override with JSON, e.g. TOOL_OUTPUT_BUDGETS='{"get_asana_tasks": {"max_items": 50, "max_chars": 8000}}'
+TOOL_OUTPUT_BUDGETS = {
+    "batch_task_operations": {"max_items": 100, "max_chars": 16000},
+    **json.loads(os.getenv("TOOL_OUTPUT_BUDGETS", "{}")),
+}
+
+
+def output_budget(tool_name):
+    """Return (max_items, max_chars) for a tool"""
+    budget = TOOL_OUTPUT_BUDGETS.get(tool_name, {})
+    return budget.get("max_items", DEFAULT_MAX_ITEMS), budget.get("max_chars", DEFAULT_MAX_CHARS)
+
+
+def project(record, fields):
+    """
+    Keep only the given fields of a record, dropping empty values
+
+    Args:
+        record (dict): An Asana record
+        fields (str): Comma-separated opt_fields style names; "assignee.name" keeps
+            only the name of the nested assignee
+
+    Returns:
+        dict: The projected record
+    """
+    nested = {}
+    for field in fields.split(","):
+        head, _, rest = field.partition(".")
+        nested.setdefault(head, []).append(rest)
+
+    projected = {"gid": record["gid"]} if "gid" in record else {}
+    for head, rests in nested.items():
+        value = record.get(head)
+        if value is None or value == "" or value == []:
+            continue
+        if isinstance(value, dict) and all(rests):
+            value = project(value, ",".join(rests))
+            value.pop("gid", None)
+        projected[head] = value
+    return projected
+
+
+def render_tool_output(tool_name, data, fields=None):
+    """
+    Serialize a tool result compactly for the model
+
+    Records are projected to `fields`, lists are cut to the tool's max_items with a
+    note saying how many were left out, and the text is cut to the tool's max_chars.
+
+    Args:
+        tool_name (str): The tool, used to look up its output budget
+        data (dict or list): The result to render
+        fields (str, optional): Fields to keep in each record, all fields if not given
+
+    Returns:
+        str: Compact JSON, followed by a note if anything was left out
+    """
+    max_items, max_chars = output_budget(tool_name)
+
+    omitted_items = 0
+    if isinstance(data, list) and len(data) > max_items:
+        omitted_items = len(data) - max_items
+        data = data[:max_items]
+
+    if fields:
+        if isinstance(data, list):
+            data = [project(item, fields) if isinstance(item, dict) else item for item in data]
+        elif isinstance(data, dict):
+            data = project(data, fields)
+
+    text = json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+    if len(text) > max_chars:
+        text = f"{text[:max_chars]}... [{len(text) - max_chars} characters omitted]"
+    if omitted_items:
+        text += f"\n({omitted_items} more not shown)"
+    return text
@@ -0,0 +1,168 @@
+import inspect
+import json
+import re
+
+# Docstring types mapped to JSON schema types
+JSON_TYPES = {
+    "str": "string",
+    "int": "integer",
+    "float": "number",
+    "bool": "boolean",
+    "list": "array",
+    "dict": "object",
+}
+
+# Matches an "Args:" entry such as "due_on (str, optional): New due date"
+ARG_PATTERN = re.compile(r"^(\w+)\s*\(([^)]*)\)\s*:\s*(.*)$")
+SECTION_PATTERN = re.compile(r"^[A-Z]\w*( \w+)*:$")
+
+
+def parse_docstring(docstring):
+    """
+    Split a docstring into its summary and its documented arguments
+
+    Returns:
+        tuple: (summary, {name: (type, description)})
+    """
+    lines = inspect.cleandoc(docstring or "").splitlines()
+
+    summary_lines = []
+    for line in lines:
+        if not line.strip():
+            break
+        summary_lines.append(line.strip())
+
+    args = {}
+    current = None
+    in_args = False
+    for line in lines:
+        stripped = line.strip()
+        if stripped == "Args:":
+            in_args = True
+            continue
+        if not in_args:
+            continue
+        if SECTION_PATTERN.match(stripped):
+            break
+        match = ARG_PATTERN.match(stripped)
+        if match:
+            name, type_spec, description = match.groups()
+            current = name
+            args[name] = (type_spec.split(",")[0].strip(), description.strip())
+        elif stripped and current:
+            # Continuation of the previous argument's description
+            type_name, description = args[current]
+            args[current] = (type_name, f"{description} {stripped}")
+    return " ".join(summary_lines), args
+
+
+class ToolRegistry:
+    """
+    Registry of the functions the AI can call
+
+    Each function is registered with the @tool decorator, which builds its OpenAI
+    tool schema once from the signature and the docstring: the summary line
+    becomes the description, the "Args:" entries the parameters, and parameters
+    without a default value are required. The registry exposes the schemas as a
+    tuple that is built once (and as pre-serialized JSON), plus a name -> function
+    dispatch table.
+
+    Tools registered with read_only=True only read data. A turn that calls nothing
+    else has no side effects, so its answer may be served from a cache.
+    """
+
+    def __init__(self):
+        self._functions = {}
+        self._read_only = set()
+        self._schemas = []
+        self._tools = ()
+        self._tools_json = "[]"
+
+    def tool(self, func=None, *, enums=None, properties=None, read_only=False):
+        """
+        Register a function as a tool
+
+        Args:
+            func (callable): The function to register
+            enums (dict, optional): Allowed values for parameters, by parameter name
+            properties (dict, optional): Extra schema keys for parameters, by parameter name,
+                e.g. the "items" schema of a list parameter
+            read_only (bool, optional): Whether the tool has no side effects
+        """
+        def register(func):
+            self._functions[func.__name__] = func
+            if read_only:
+                self._read_only.add(func.__name__)
+            self._schemas.append(self._build_schema(func, enums or {}, properties or {}))
+            self._tools = tuple(self._schemas)
+            self._tools_json = json.dumps(self._tools, separators=(",", ":"))
+            return func
+
+        if func is not None:
+            return register(func)
+        return register
+
+    @staticmethod
+    def _build_schema(func, enums, extra_properties):
+        summary, documented = parse_docstring(func.__doc__)
+        properties = {}
+        required = []
+        for name, parameter in inspect.signature(func).parameters.items():
+            type_name, description = documented.get(name, ("str", ""))
+            prop = {"type": JSON_TYPES.get(type_name, "string")}
+            if description:
+                prop["description"] = description
+            if name in enums:
+                prop["enum"] = list(enums[name])
+            prop.update(extra_properties.get(name, {}))
+            properties[name] = prop
+            if parameter.default is inspect.Parameter.empty:
+                required.append(name)
+
+        parameters = {"type": "object", "properties": properties}
+        if required:
+            parameters["required"] = required
+        return {
+            "type": "function",
+            "function": {
+                "name": func.__name__,
+                "description": summary,
+                "parameters": parameters,
+            },
+        }
+
+    @property
+    def tools(self):
+        """The tool schemas to pass to the OpenAI API"""
+        return self._tools
+
+    @property
+    def tools_json(self):
+        """The tool schemas serialized once as compact JSON"""
+        return self._tools_json
+
+    def __contains__(self, name):
+        return name in self._functions
+
+    def is_read_only(self, name):
+        """Whether the tool was registered as read-only"""
+        return name in self._read_only
+
+    def get(self, name):
+        """Return the function registered under name"""
+        return self._functions[name]
+
+    def call(self, name, arguments):
+        """
+        Call a registered tool
+
+        Args:
+            name (str): The tool name
+            arguments (str): The JSON-encoded arguments from the model's tool call
+        """
+        return self._functions[name](**json.loads(arguments or "{}"))
+
+
+# Shared registry of the tools defined in agents.py, used by the CLI and the API
+registry = ToolRegistry()
+tool = registry.tool